@@ -0,0 +1,442 @@
+import asyncio
+import heapq
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+LIBRARY_SIZES = (100, 1000, 10000, 100000)
+STATION_COUNTS = (4, 16, 64)
+SCAN_SIZES = (10, 1000, 10000, 100000)  # Files in the folder scan benchmark
+STARTUP_SONGS = 200  # Songs in each station's folder for the startup benchmark
+STARTUP_TIMEOUT = 120  # Seconds to wait for every station to be ready
+FILES_PER_FOLDER = 100  # Synthetic files are spread over folders of this size
+FAKE_FREQUENCY = 8000  # The fake mixer plays 8 kHz mono 16-bit, which keeps synthetic tracks small
+SIM_STATIONS = 8  # Stations in the track switch and soak benchmarks
+SIM_SONGS = 500  # Songs per station in the track switch and soak benchmarks
+SIM_VOICE_LINES = 20  # Voice lines per station in the track switch and soak benchmarks
+SWITCH_ROUNDS = 50  # Station switches and track skips timed by the track switch benchmark
+SOAK_HOURS = 2.0  # Default simulated time of the soak benchmark
+SOAK_TUNE_EVERY = 600  # Simulated seconds between station changes in the soak benchmark
+SETTLE_TIMEOUT = 0.05  # Real seconds the simulation waits for a decoder to catch up with the virtual clock
+
+
+def get_version():
+    # Commit the benchmark ran against, so results can be compared across versions
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(samples):
+    # Count, median, 95th percentile and maximum of a list of seconds, in milliseconds
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[int(len(samples) * 0.95)] * 1000,
+        "max_ms": samples[-1] * 1000,
+    } if samples else None
+
+
+def synthetic_library(size):
+    # Song and voice line paths for a station with the given number of songs
+    songs = [f"/music/Artist {i % 500} - Song {i}.mp3" for i in range(size)]
+    voice_lines = [f"/voice/Line {i}.mp3" for i in range(max(size // 20, 1))]
+    return songs, voice_lines
+
+
+def synthetic_folder(folder, size, name="Artist {artist} - Song {i}.mp3"):
+    # Create size audio files below folder, FILES_PER_FOLDER to a subfolder; each holds its own name,
+    # so the audio cache, which is keyed by file contents, tells them apart
+    for i in range(size):
+        subfolder = os.path.join(folder, f"disc {i // FILES_PER_FOLDER}")
+        if i % FILES_PER_FOLDER == 0:
+            os.makedirs(subfolder)
+        path = os.path.join(subfolder, name.format(artist=i % 50, i=i))
+        with open(path, "w") as f:
+            f.write(path)
+    return folder
+
+
+def synthetic_duration(path):
+    # Length in seconds of a synthetic audio file: songs run two to five minutes, voice lines a few seconds
+    spread = zlib.crc32(path.encode())
+    return 3 + spread % 12 if "Voice" in path else 120 + spread % 180
+
+
+class VirtualClock:
+    # Stands in for the time module inside radio_beta, so simulated hours pass in seconds;
+    # perf_counter and everything else stay real, so durations are still measured in real time
+    def __init__(self):
+        self.now = 0.0
+        self.epoch = time.time()
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.epoch + self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class FakeSound:
+    # Silent PCM in the fake mixer's format
+    def __init__(self, file=None, buffer=None):
+        self.raw = bytes(buffer) if buffer is not None else bytes(int(synthetic_duration(file) * FAKE_FREQUENCY) * 2)
+
+    def get_raw(self):
+        return self.raw
+
+    def get_length(self):
+        return len(self.raw) / (FAKE_FREQUENCY * 2)
+
+
+class FakeChannel:
+    # A mixer channel that plays a sound and a queued one for as long as they last on the virtual clock
+    def __init__(self, clock):
+        self.clock = clock
+        self.current = None
+        self.queued = None
+        self.ends = 0.0
+        self.volume = 1.0
+
+    def advance(self):
+        while self.current is not None and self.clock.now >= self.ends:
+            self.current, self.queued = self.queued, None
+            if self.current is not None:
+                self.ends += self.current.get_length()
+
+    def play(self, sound):
+        self.current, self.queued = sound, None
+        self.ends = self.clock.now + sound.get_length()
+
+    def queue(self, sound):
+        if self.get_busy():
+            self.queued = sound
+        else:
+            self.play(sound)
+
+    def get_queue(self):
+        self.advance()
+        return self.queued
+
+    def get_busy(self):
+        self.advance()
+        return self.current is not None
+
+    def stop(self):
+        self.current = self.queued = None
+
+    def fadeout(self, ms):
+        self.stop()
+
+    def set_volume(self, volume):
+        self.volume = volume
+
+    def get_volume(self):
+        return self.volume
+
+
+class FakeMixer:
+    # Stands in for pygame.mixer: there is no audio device, and nothing is decoded but silence
+    def __init__(self, clock):
+        self.clock = clock
+        self.format = None
+        self.channels = [FakeChannel(clock) for _ in range(8)]
+
+    def init(self, *args, **kwargs):
+        self.format = (FAKE_FREQUENCY, -16, 1)
+
+    def get_init(self):
+        return self.format
+
+    def get_num_channels(self):
+        return len(self.channels)
+
+    def set_num_channels(self, count):
+        self.channels += [FakeChannel(self.clock) for _ in range(count - len(self.channels))]
+
+    def Channel(self, index):
+        return self.channels[index]
+
+    def Sound(self, file=None, buffer=None):
+        return FakeSound(file, buffer)
+
+
+class SimulatedLoop:
+    # Runs the playback scheduler's timers in virtual time, as fast as the CPU allows
+    def __init__(self, clock):
+        self.clock = clock
+        self.timers = []  # Heap of [due time, sequence number, callback]; cancelled timers have no callback
+        self.sequence = 0
+        self.cpu_seconds = 0.0  # CPU time of this thread spent in timer callbacks
+
+    def schedule(self, delay, callback):
+        self.sequence += 1
+        timer = [self.clock.now + delay / 1000, self.sequence, callback]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        timer[2] = None
+
+    def run_until(self, end, settle=None):
+        # Fire every timer due before end, in order, moving the clock to each one
+        while self.timers and self.timers[0][0] <= end:
+            due, _, callback = heapq.heappop(self.timers)
+            self.clock.now = max(self.clock.now, due)
+            if callback:
+                started = time.thread_time()
+                callback()
+                self.cpu_seconds += time.thread_time() - started
+            if settle:
+                settle()
+        self.clock.now = max(self.clock.now, end)
+
+
+def install_fakes(clock):
+    # Point radio_beta at the fake mixer and the virtual clock, without ffmpeg
+    import radio_beta
+    radio_beta.mixer = FakeMixer(clock)
+    radio_beta.time = clock
+    radio_beta.FFMPEG = radio_beta.FFPROBE = None
+    radio_beta.read_header_duration = synthetic_duration  # Synthetic files have no header, but a known length
+    return radio_beta
+
+
+def simulated_stations(folder, stations, songs, virtual_radio=True):
+    # Settings file for stations with synthetic song and voice line folders
+    settings = {"num_stations": stations, "stations": [], "virtual_radio": virtual_radio, "normalize_loudness": False}
+    for station_index in range(stations):
+        songs_folder = synthetic_folder(os.path.join(folder, f"Station {station_index}", "Songs"), songs)
+        voice_lines_folder = synthetic_folder(os.path.join(folder, f"Station {station_index}", "Voice"), SIM_VOICE_LINES, "Voice Line {i}.mp3")
+        settings["stations"].append({"name": f"Station {station_index}", "songs_folder": songs_folder, "voice_lines_folder": voice_lines_folder})
+    settings_file = os.path.join(folder, "settings.json")
+    with open(settings_file, "w") as f:
+        json.dump(settings, f)
+    return settings_file
+
+
+class Simulation:
+    # A RadioEngine running on the fake mixer and the virtual clock, in a temporary folder
+    def __init__(self, folder, stations=SIM_STATIONS, songs=SIM_SONGS, virtual_radio=True):
+        self.clock = VirtualClock()
+        self.radio = install_fakes(self.clock)
+        self.loop = SimulatedLoop(self.clock)
+        self.folder = folder
+        self.previous_folder = os.getcwd()
+        os.chdir(folder)  # The media library, audio cache and state files go next to the settings
+        self.engine = self.radio.RadioEngine(simulated_stations(folder, stations, songs, virtual_radio))
+        self.tracks = 0
+        self.engine.on_track_change = self.count_track
+
+    def count_track(self, station_index):
+        self.tracks += 1
+
+    def start(self):
+        # Start the engine and run until every station's folders have been scanned
+        self.engine.start(self.radio.PlaybackScheduler(self.loop.schedule, self.loop.cancel))
+        while not all(self.engine.scanned):
+            time.sleep(0.01)
+            self.run(self.radio.SCHEDULER_INTERVAL / 1000)
+
+    def settle(self):
+        # Give decoder threads real time to keep ahead of the virtual clock, as they would be in real time
+        deadline = time.perf_counter() + SETTLE_TIMEOUT
+        for stream in self.engine.streams:
+            while stream and not stream.finished and stream.buffered < 2 and time.perf_counter() < deadline:
+                time.sleep(0.0005)
+
+    def run(self, seconds):
+        # Advance the virtual clock, firing every scheduler tick on the way
+        self.loop.run_until(self.clock.now + seconds, self.settle)
+
+    def stop(self):
+        self.engine.stop_playback()
+        os.chdir(self.previous_folder)
+
+
+def bench_playlist_build(size):
+    # Time to the first track and to a full cycle of a lazily generated playlist
+    from radio_beta import PlaylistEngine, NoRepeatWindow, ArtistSeparation, split_track_name
+    songs, voice_lines = synthetic_library(size)
+    rules = [NoRepeatWindow(20), ArtistSeparation(3, lambda track: split_track_name(track)[0])]
+    start = time.perf_counter()
+    tracks = iter(PlaylistEngine(songs, voice_lines, random.Random(size), rules))
+    next(tracks)
+    first_track = time.perf_counter() - start
+    count = 1 + sum(1 for _ in tracks)
+    full_cycle = time.perf_counter() - start
+    return {"benchmark": "playlist_build", "songs": size, "tracks": count, "first_track_ms": first_track * 1000, "full_cycle_ms": full_cycle * 1000}
+
+
+def bench_folder_scan(size):
+    # Media library scan of a synthetic folder: first scan, rescan with nothing changed, rescan after one new file
+    from radio_beta import MediaLibrary
+    with tempfile.TemporaryDirectory() as folder:
+        songs_folder = synthetic_folder(os.path.join(folder, "Songs"), size)
+        library = MediaLibrary(os.path.join(folder, "library.db"))
+        start = time.perf_counter()
+        library.scan(songs_folder)
+        first_scan = time.perf_counter() - start
+        start = time.perf_counter()
+        library.scan(songs_folder)
+        unchanged = time.perf_counter() - start
+        time.sleep(0.01)  # Make sure the folder's modification time moves on
+        open(os.path.join(songs_folder, "disc 0", "New Song.mp3"), "w").close()
+        start = time.perf_counter()
+        added, _ = library.scan(songs_folder)
+        one_added = time.perf_counter() - start
+        start = time.perf_counter()
+        count = len(library.tracks(songs_folder))
+        list_tracks = time.perf_counter() - start
+        library.close()
+    return {"benchmark": "folder_scan", "files": size, "tracks": count, "added": len(added), "first_scan_ms": first_scan * 1000,
+            "unchanged_rescan_ms": unchanged * 1000, "one_added_rescan_ms": one_added * 1000, "list_tracks_ms": list_tracks * 1000}
+
+
+def bench_track_switch(stations):
+    # Real time taken by station switches and track skips, on the fake mixer
+    with tempfile.TemporaryDirectory() as folder:
+        simulation = Simulation(folder, stations)
+        simulation.start()
+        rng = random.Random(stations)
+        tunes, skips = [], []
+        for _ in range(SWITCH_ROUNDS):
+            simulation.run(rng.uniform(1, 300))
+            station = rng.randrange(1, stations + 1)
+            start = time.perf_counter()
+            simulation.engine.tune(station)
+            tunes.append(time.perf_counter() - start)
+            simulation.run(rng.uniform(1, 30))
+            start = time.perf_counter()
+            simulation.engine.skip_track()
+            skips.append(time.perf_counter() - start)
+        simulation.stop()
+    return {"benchmark": "track_switch", "stations": stations, "tune": summarize(tunes), "skip": summarize(skips)}
+
+
+def bench_soak(hours):
+    # Play for simulated hours, changing station every SOAK_TUNE_EVERY seconds: scheduler CPU, gaps and peak memory
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as folder:
+        simulation = Simulation(folder)
+        simulation.start()
+        started = time.perf_counter()
+        station = 0
+        elapsed = 0.0
+        while elapsed < hours * 3600:
+            station = station % SIM_STATIONS + 1
+            simulation.engine.tune(station)
+            simulation.run(SOAK_TUNE_EVERY)
+            elapsed += SOAK_TUNE_EVERY
+        wall = time.perf_counter() - started
+        metrics = simulation.engine.collect_metrics()
+        simulation.stop()
+    peak_python = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "benchmark": "soak",
+        "simulated_hours": hours,
+        "stations": SIM_STATIONS,
+        "wall_s": wall,
+        "scheduler_cpu_s": simulation.loop.cpu_seconds,
+        "scheduler_cpu_ms_per_hour": simulation.loop.cpu_seconds / hours * 1000,
+        "ticks": simulation.engine.scheduler.ticks,
+        "tracks": simulation.tracks,
+        "tick": metrics["overall"].get("tick"),
+        "gaps": sum(station_metrics["gap"]["count"] for station_metrics in metrics["stations"].values() if "gap" in station_metrics),
+        "peak_python_bytes": peak_python,
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def synthetic_stations(folder, stations):
+    # Settings file for the given number of stations, each with a folder of empty song files
+    settings = {"num_stations": stations, "stations": [], "current_station": 1}
+    for station_index in range(stations):
+        songs_folder = os.path.join(folder, f"station {station_index}")
+        os.makedirs(songs_folder)
+        for i in range(STARTUP_SONGS):
+            open(os.path.join(songs_folder, f"Artist {i % 20} - Song {i}.mp3"), "w").close()
+        settings["stations"].append({"name": f"Station {station_index}", "songs_folder": songs_folder, "voice_lines_folder": ""})
+    settings_file = os.path.join(folder, "settings.json")
+    with open(settings_file, "w") as f:
+        json.dump(settings, f)
+    return settings_file
+
+
+def run_startup(settings_file):
+    # Start one headless engine in this process and time each startup phase, from a cold import on
+    start = time.perf_counter()
+    import radio_beta
+    imported = time.perf_counter()
+
+    async def main():
+        engine = radio_beta.RadioEngine(settings_file)
+        loaded = time.perf_counter()
+        engine.start(radio_beta.PlaybackScheduler.for_asyncio(asyncio.get_running_loop()))
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not all(engine.scanned) and time.monotonic() < deadline:
+            await asyncio.sleep(0.005)
+        engine.stop_playback()
+        return {"import_ms": (imported - start) * 1000, "settings_ms": (loaded - imported) * 1000, **{f"{phase}_ms": ms for phase, ms in engine.startup_times.items()}}
+
+    return asyncio.run(main())
+
+
+def bench_startup(stations):
+    # Startup phases with an empty media library (cold) and again with the library already built (warm)
+    with tempfile.TemporaryDirectory() as folder:
+        settings_file = synthetic_stations(folder, stations)
+        results = {"benchmark": "startup", "stations": stations, "songs_per_station": STARTUP_SONGS}
+        for run in ("cold", "warm"):
+            # A fresh interpreter each time, so imports are timed as they are at launch
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "startup-run", settings_file], cwd=folder,
+                                    capture_output=True, text=True, check=True).stdout
+            results[run] = json.loads(output.splitlines()[-1])
+        return results
+
+
+BENCHMARKS = {
+    # Suite name: (benchmark, default arguments)
+    "playlist": (bench_playlist_build, LIBRARY_SIZES),
+    "scan": (bench_folder_scan, SCAN_SIZES),
+    "switch": (bench_track_switch, (SIM_STATIONS,)),
+    "soak": (bench_soak, (SOAK_HOURS,)),
+    "startup": (bench_startup, STATION_COUNTS),
+}
+
+
+if __name__ == "__main__":
+    # python benchmark.py [playlist|scan|switch|soak|startup|all] [arguments...] [--output results.jsonl]
+    args = sys.argv[1:]
+    output = None
+    if "--output" in args:
+        index = args.index("--output")
+        output = args[index + 1]
+        del args[index:index + 2]
+    if args[:1] == ["startup-run"]:
+        print(json.dumps(run_startup(args[1])))
+        sys.exit()
+    suite = args.pop(0) if args and args[0] in (*BENCHMARKS, "all") else "playlist"
+    version = get_version()
+    for name in BENCHMARKS if suite == "all" else [suite]:
+        benchmark, defaults = BENCHMARKS[name]
+        for value in [float(arg) if "." in arg else int(arg) for arg in args] or defaults:
+            result = {**benchmark(value), "version": version, "timestamp": time.time()}
+            print(json.dumps(result), flush=True)
+            if output:
+                with open(output, "a") as f:
+                    f.write(json.dumps(result) + "\n")
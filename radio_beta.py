@@ -3,50 +3,3038 @@ import random
 import json
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from pygame import mixer
 import sys
-from pynput import keyboard
 import time
+import queue
+import shutil
+import subprocess
+import threading
+import heapq
+import sqlite3
+import select
+import struct
+import ctypes
+import ctypes.util
+import hashlib
+import mmap
+import tempfile
+import zlib
+import wave
+import itertools
+import bisect
+import asyncio
+import argparse
+import signal
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+
+log = logging.getLogger("radio_beta")
+
+# pygame, pynput and NumPy are slow to import, so they are imported on first use (see import_mixer,
+# import_keyboard and import_numpy) rather than before the window can appear
+mixer = None
+keyboard = None
+numpy = None
+numpy_checked = False
 
 SETTINGS_FILE = "settings.json"
+LIBRARY_FILE = "library.db"  # On-disk index of every station's audio files
+AUDIO_EXTENSIONS = (".mp3", ".flac", ".ogg", ".wav")  # File extensions picked up by the library (case-insensitive)
+CACHE_FOLDER = "audio_cache"  # Decoded audio kept on disk so replays skip decoding
+CACHE_LIMIT = 2 * 1024 ** 3  # Size cap of the decoded audio cache in bytes
+CACHE_HASH_BYTES = 1024 * 1024  # Bytes read from each end of a file to build its cache key
+CACHE_HEADER = struct.Struct("<4siiiQI")  # Magic, frequency, sample size, channels, payload length, CRC-32
+CACHE_MAGIC = b"RPCM"
+FFMPEG = shutil.which("ffmpeg")  # Used for streaming decode when available
+FFPROBE = shutil.which("ffprobe")  # Used to read track durations when available
+BLOCK_SECONDS = 0.5  # Length of each decoded block fed to a channel
+RING_BLOCKS = 8  # Number of decoded blocks buffered ahead per station
+FIRST_BLOCK_TIMEOUT = 0.05  # How long play_audio waits for the first block
+SAMPLE_FORMATS = {8: "u8", -8: "s8", 16: "u16le", -16: "s16le", 32: "f32le"}
+SAMPLE_TYPES = {-8: ("<i1", 127), -16: ("<i2", 32767), 32: ("<f4", 1.0)}  # NumPy type and full scale of signed mixer formats
+CROSSFADE_SECONDS = 2.0  # Default length of the crossfade between consecutive tracks (0 for a gapless cut)
+TUNING_SECONDS = 0.4  # Length of the fade when tuning from one station to another
+STATIC_LEVEL = 0.15  # Level of the static burst heard while tuning, relative to full scale
+PREFETCH_AHEAD = 2  # Number of upcoming tracks per station decoded ahead of time
+PREFETCH_BLOCKS = 4  # Number of leading blocks kept ready for each upcoming track
+PREFETCH_BUDGET = 32 * 1024 * 1024  # Bytes of prefetched audio kept across all stations
+PREFETCH_WORKERS = 2  # Size of the prefetch worker pool
+VOICE_LINE_MAX_SECONDS = 30  # Voice lines up to this long are kept decoded in their folder's voice line bank
+VOICE_BANK_LIMIT = 64 * 1024 * 1024  # Bytes of decoded voice lines per bank; the lines past it are streamed like songs
+SCHEDULER_INTERVAL = 100  # Milliseconds between playback scheduler ticks
+PRESET_BUTTONS = 6  # Number of station preset buttons; further stations are reached through their tabs
+SETTINGS_ROWS = 4  # Stations shown at once in the settings tab; the rest are scrolled into the same widgets
+VOLUME_STEP = 0.1  # Volume change per press of the volume keys
+HOTKEY_DEBOUNCE = 0.03  # Seconds within which a repeat of the same hotkey is ignored
+HOTKEY_LATENCY_SAMPLES = 256  # Number of recent hotkey latencies kept for the statistics
+STATE_INTERVAL = 5.0  # Seconds between playback state snapshots
+METRICS_INTERVAL = 60.0  # Seconds between metrics reports in the log (and the metrics file, if set)
+METRICS_SAMPLES = 512  # Recent samples kept for each timing's percentiles
+CONTROL_ADDRESS = "127.0.0.1:8765"  # Suggested control API address; the API only runs when an address is given
+BROADCAST_ADDRESS = "0.0.0.0:8000"  # Suggested broadcast address; stations are only broadcast when an address is given
+BROADCAST_RING = 64  # Encoded chunks kept per broadcast station; listeners that fall further behind skip ahead
+BROADCAST_BURST = 8  # Chunks sent at once to a new (or skipping) listener, so its player can start right away
+BROADCAST_QUEUE = 32  # Blocks waiting for a station's encoder before further blocks are dropped
+BROADCAST_TIMEOUT = 10.0  # Seconds a listener may take to accept data before it is disconnected
+BROADCAST_BITRATE = "128k"  # MP3 bitrate of broadcasts when ffmpeg is available; without it they are sent as WAV
+BROADCAST_CHUNK = 4096  # Bytes read from the MP3 encoder at a time
+PLAYLIST_HISTORY = 200  # Number of recently played songs per station that rotation rules can look back on
+ROTATION_TRIES = 8  # Candidates tried before a rotation rule is ignored for one pick
+PROGRAM_DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")  # Day names of a show block's "days", in time.localtime() order
+ADS_PER_BREAK = 2  # Default number of ads played in each ad break
+PROGRAM_CHECK_INTERVAL = 30.0  # Seconds between checks for a show starting on a station that has nothing to play
+LOUDNESS_TARGET = -18.0  # Integrated loudness (LUFS) every track is brought to, as in ReplayGain 2
+LOUDNESS_WORKERS = 2  # Processes used for loudness analysis
+LOUDNESS_BATCH = 16  # Tracks handed to the analysis processes at a time
+LOUDNESS_IDLE = 30.0  # Seconds between checks for new tracks once everything has been analyzed
+DURATION_BATCH = 64  # Tracks looked up at a time by the duration prober
+DURATION_IDLE = 5.0  # Seconds between checks for new tracks once every duration is known
+K_WEIGHTING = [  # BS.1770 K-weighting filter at 48 kHz as (b, a) biquad coefficients: high shelf, then high pass
+    ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585]),
+    ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621]),
+]
+SCAN_WORKERS = 2  # Threads scanning station folders in the background, at startup and when a folder is changed
+WATCH_DEBOUNCE = 1.0  # Seconds a changed folder must stay quiet before it is rescanned
+WATCH_POLL_INTERVAL = 5.0  # Seconds between rescans of folders that cannot be watched with inotify, or not reliably
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "9p", "ceph", "glusterfs", "fuse.sshfs", "fuse.rclone")
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+
+
+def import_mixer():
+    # pygame's mixer, imported the first time playback needs it
+    global mixer
+    if mixer is None:
+        from pygame import mixer as pygame_mixer
+        mixer = pygame_mixer
+    return mixer
+
+
+def import_keyboard():
+    # pynput's keyboard, imported the first time global hotkeys are registered
+    global keyboard
+    if keyboard is None:
+        from pynput import keyboard as pynput_keyboard
+        keyboard = pynput_keyboard
+    return keyboard
+
+
+def import_numpy():
+    # NumPy, imported the first time it is needed, or None without it (loudness analysis and crossfades are skipped)
+    global numpy, numpy_checked
+    if not numpy_checked:
+        numpy_checked = True
+        try:
+            import numpy as module
+            numpy = module
+        except ImportError:
+            pass
+    return numpy
+
+
+def get_block_bytes(block_seconds=BLOCK_SECONDS):
+    # Size in bytes of one decoded block in the mixer's output format
+    frequency, size, channels = mixer.get_init()
+    return int(frequency * block_seconds) * (abs(size) // 8 * channels)
+
+
+def get_offset_bytes(offset):
+    # Position in bytes of a time offset in seconds within PCM in the mixer's output format
+    frequency, size, channels = mixer.get_init()
+    return int(offset * frequency) * (abs(size) // 8 * channels)
+
+
+def iter_pcm_blocks(path, block_bytes, offset=0, cache=None):
+    # Yield raw PCM blocks of the given size for a track, in the mixer's output format, starting offset seconds in
+    if cache is not None:
+        pcm = cache.open(path)
+        if pcm is not None:
+            # Already decoded once: just slice the memory-mapped cache entry
+            with pcm:
+                for start in range(get_offset_bytes(offset), len(pcm), block_bytes):
+                    yield pcm.read(start, block_bytes)
+            return
+    # Only a decode from the very start produces a complete cache entry
+    writer = cache.writer(path) if cache is not None and not offset else None
+    try:
+        for block in decode_pcm_blocks(path, block_bytes, offset):
+            if writer:
+                try:
+                    writer.write(block)
+                except OSError as e:
+                    # A full or failing cache disk only stops the caching, never the track
+                    log.warning("Not caching %s: %s", path, e)
+                    writer.discard()
+                    writer = None
+            yield block
+        if writer:
+            try:
+                writer.commit()
+            except OSError as e:
+                log.warning("Not caching %s: %s", path, e)
+                writer.discard()
+            writer = None
+    finally:
+        if writer:
+            writer.discard()
+
+
+def decode_pcm_blocks(path, block_bytes, offset=0):
+    # Decode a track into raw PCM blocks of the given size, starting offset seconds in
+    frequency, size, channels = mixer.get_init()
+    frame_bytes = abs(size) // 8 * channels
+    if FFMPEG and size in SAMPLE_FORMATS:
+        command = [FFMPEG, "-v", "quiet", "-ss", f"{offset:.3f}", "-i", path, "-f", SAMPLE_FORMATS[size], "-ac", str(channels), "-ar", str(frequency), "-"]
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        try:
+            while True:
+                block = process.stdout.read(block_bytes)
+                if not block:
+                    break
+                yield block[:len(block) - len(block) % frame_bytes]
+        finally:
+            process.kill()
+            process.stdout.close()
+            process.wait()
+    else:
+        # Without ffmpeg fall back to a full decode, then hand it out block by block
+        raw = mixer.Sound(path).get_raw()
+        for start in range(get_offset_bytes(offset), len(raw), block_bytes):
+            yield raw[start:start + block_bytes]
+
+
+class CachedPCM:
+    # Read-only view of the PCM payload of a memory-mapped cache entry
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) - CACHE_HEADER.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.data.close()
+
+    def read(self, start, length):
+        start += CACHE_HEADER.size
+        return self.data[start:start + length]
+
+
+class CacheWriter:
+    # Writes a cache entry to a temporary file and moves it into place once it is complete
+    def __init__(self, cache, entry):
+        self.cache = cache
+        self.entry = entry
+        descriptor, self.temp_path = tempfile.mkstemp(dir=cache.folder, suffix=".tmp")
+        self.file = os.fdopen(descriptor, "wb")
+        self.file.write(bytes(CACHE_HEADER.size))
+        self.length = 0
+        self.crc = 0
+
+    def write(self, block):
+        self.file.write(block)
+        self.length += len(block)
+        self.crc = zlib.crc32(block, self.crc)
+
+    def commit(self):
+        # Fill in the header and atomically publish the entry
+        self.file.seek(0)
+        self.file.write(CACHE_HEADER.pack(CACHE_MAGIC, *mixer.get_init(), self.length, self.crc))
+        self.file.close()
+        with self.cache.lock:
+            # Another stream may have cached the same track meanwhile; only the difference is new
+            try:
+                replaced = os.path.getsize(self.entry)
+            except OSError:
+                replaced = 0
+            os.replace(self.temp_path, self.entry)
+        self.cache.added(self.entry, CACHE_HEADER.size + self.length - replaced)
+
+    def discard(self):
+        # Drop an incomplete entry
+        try:
+            self.file.close()
+        except OSError:
+            pass  # The data that could not be flushed is being thrown away anyway
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+
+class AudioCache:
+    # Decoded PCM on disk keyed by a hash of the file contents, capped in size with LRU eviction
+    def __init__(self, folder=CACHE_FOLDER, limit=CACHE_LIMIT):
+        self.folder = folder
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.keys = {}  # Cache key by (path, mtime, size), so files are only hashed once
+        self.verified = set()  # Entries whose checksum has been checked since startup
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+        self.total = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(".tmp"):
+                    # Left over from an interrupted decode
+                    os.remove(entry.path)
+                elif entry.name.endswith(".pcm"):
+                    self.total += entry.stat().st_size
+
+    def entry(self, path):
+        # Cache file for a track, named after a hash of its size, its first and last bytes and the mixer format
+        stat = os.stat(path)
+        identity = (path, stat.st_mtime, stat.st_size)
+        if identity not in self.keys:
+            digest = hashlib.blake2b(digest_size=20)
+            digest.update(repr((mixer.get_init(), stat.st_size)).encode())
+            with open(path, "rb") as f:
+                digest.update(f.read(CACHE_HASH_BYTES))
+                if stat.st_size > 2 * CACHE_HASH_BYTES:
+                    f.seek(-CACHE_HASH_BYTES, os.SEEK_END)
+                    digest.update(f.read(CACHE_HASH_BYTES))
+            self.keys[identity] = os.path.join(self.folder, digest.hexdigest() + ".pcm")
+        return self.keys[identity]
+
+    def open(self, path):
+        # Memory-map the cached PCM for a track, or return None if there is no intact entry
+        try:
+            entry = self.entry(path)
+            with open(entry, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if not self.is_intact(entry, data):
+            data.close()
+            self.remove(entry)
+            self.misses += 1
+            return None
+        os.utime(entry)  # Mark as recently used
+        self.hits += 1
+        return CachedPCM(data)
+
+    def is_intact(self, entry, data):
+        # Check the header against the mixer format and, once per run, the payload checksum
+        if len(data) < CACHE_HEADER.size:
+            return False
+        magic, frequency, size, channels, length, crc = CACHE_HEADER.unpack_from(data)
+        if magic != CACHE_MAGIC or (frequency, size, channels) != tuple(mixer.get_init()) or length != len(data) - CACHE_HEADER.size:
+            return False
+        if entry not in self.verified:
+            actual = 0
+            view = memoryview(data)
+            for start in range(CACHE_HEADER.size, len(data), CACHE_HASH_BYTES):
+                actual = zlib.crc32(view[start:start + CACHE_HASH_BYTES], actual)
+            view.release()
+            if actual != crc:
+                return False
+            self.verified.add(entry)
+        return True
+
+    def writer(self, path):
+        # Start a new entry for a track, or None if the track cannot be read
+        try:
+            return CacheWriter(self, self.entry(path))
+        except OSError:
+            return None
+
+    def added(self, entry, size):
+        # Account for a new entry and evict the least recently used ones past the size cap
+        with self.lock:
+            self.verified.add(entry)
+            self.total += size
+            if self.total <= self.limit:
+                return
+            with os.scandir(self.folder) as entries:
+                cached = sorted((e.stat().st_mtime, e.path) for e in entries if e.name.endswith(".pcm") and e.path != entry)
+            for _, path in cached:
+                if self.total <= self.limit:
+                    break
+                self.remove(path)
+
+    def remove(self, entry):
+        # Delete an entry
+        try:
+            size = os.path.getsize(entry)
+            os.remove(entry)
+        except OSError:
+            return
+        self.total -= size
+        self.verified.discard(entry)
+
+
+def measure_loudness(path):
+    # Analysis process: integrated loudness of a track in LUFS following EBU R128 gating, or None
+    rate = 48000
+    hop = rate // 10  # Loudness is measured over 100 ms sub-blocks; four of them make a 400 ms gating block
+    if not FFMPEG or import_numpy() is None:
+        return None
+    # Power response of the K-weighting filter at each FFT bin of a sub-block, with Parseval weights
+    z = numpy.exp(-1j * numpy.pi * numpy.arange(hop // 2 + 1) / (hop // 2))
+    weights = numpy.ones(hop // 2 + 1)
+    for b, a in K_WEIGHTING:
+        weights *= numpy.abs(numpy.polyval(b[::-1], z)) ** 2 / numpy.abs(numpy.polyval(a[::-1], z)) ** 2
+    weights[1:-1] *= 2
+    weights /= hop * hop
+    command = [FFMPEG, "-v", "quiet", "-i", path, "-f", "s16le", "-ac", "2", "-ar", str(rate), "-"]
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+    powers = []
+    try:
+        while True:
+            data = process.stdout.read(hop * 4 * 100)  # Ten seconds at a time keeps memory flat
+            if len(data) < hop * 4:
+                break
+            samples = numpy.frombuffer(data[:len(data) - len(data) % (hop * 4)], dtype="<i2").reshape(-1, hop, 2) / 32768.0
+            spectrum = numpy.abs(numpy.fft.rfft(samples, axis=1)) ** 2
+            powers.append(numpy.einsum("sbc,b->s", spectrum, weights))
+    finally:
+        process.kill()
+        process.stdout.close()
+        process.wait()
+    if sum(len(power) for power in powers) < 4:
+        return None
+    blocks = numpy.maximum(numpy.convolve(numpy.concatenate(powers), numpy.ones(4) / 4, mode="valid"), 1e-12)
+    loudness = -0.691 + 10 * numpy.log10(blocks)
+    gated = blocks[loudness > -70]
+    if not gated.size:
+        return None
+    relative = -0.691 + 10 * numpy.log10(gated.mean()) - 10
+    gated = gated[-0.691 + 10 * numpy.log10(gated) > relative]
+    return float(-0.691 + 10 * numpy.log10(gated.mean()))
+
+
+def can_mix():
+    # Whether transitions can be mixed in the current mixer format
+    return import_numpy() is not None and mixer.get_init()[1] in SAMPLE_TYPES
+
+
+def pcm_to_array(data):
+    # Float frames array (one column per channel) from PCM in the mixer format
+    size, channels = mixer.get_init()[1:]
+    dtype, _ = SAMPLE_TYPES[size]
+    return numpy.frombuffer(data, dtype=dtype).reshape(-1, channels).astype(numpy.float32)
+
+
+def array_to_pcm(frames):
+    # PCM in the mixer format from a float frames array, clipped to full scale
+    dtype, full_scale = SAMPLE_TYPES[mixer.get_init()[1]]
+    return numpy.clip(frames, -full_scale, full_scale).astype(dtype).tobytes()
+
+
+def apply_gain(block, gain):
+    # PCM block scaled by a linear gain, clipped to full scale; unchanged if there is nothing to scale or no NumPy
+    if gain == 1.0 or not can_mix():
+        return block
+    return array_to_pcm(pcm_to_array(block) * gain)
+
+
+def split_blocks(data, block_bytes):
+    # Cut PCM back into blocks of the given size
+    return [data[start:start + block_bytes] for start in range(0, len(data), block_bytes)]
+
+
+def crossfade_blocks(tail, head, block_bytes):
+    # Equal-power crossfade of the last blocks of one track into the first blocks of the next
+    outgoing = b"".join(tail)
+    incoming = b"".join(head)
+    frame_bytes = abs(mixer.get_init()[1]) // 8 * mixer.get_init()[2]
+    overlap = min(len(outgoing), len(incoming)) // frame_bytes * frame_bytes
+    if not overlap:
+        return split_blocks(outgoing + incoming, block_bytes)
+    angle = (numpy.arange(overlap // frame_bytes, dtype=numpy.float32) + 0.5) / (overlap // frame_bytes) * (numpy.pi / 2)
+    mixed = pcm_to_array(outgoing[len(outgoing) - overlap:]) * numpy.cos(angle)[:, None] + pcm_to_array(incoming[:overlap]) * numpy.sin(angle)[:, None]
+    return split_blocks(outgoing[:len(outgoing) - overlap] + array_to_pcm(mixed) + incoming[overlap:], block_bytes)
+
+
+def tune_in_blocks(head, block_bytes, static=True):
+    # Fade the first blocks of a station in, under a decaying burst of static if wanted
+    frames = pcm_to_array(b"".join(head))
+    ramp = numpy.linspace(0, 1, len(frames), dtype=numpy.float32)[:, None]
+    frames = frames * ramp
+    if static:
+        full_scale = SAMPLE_TYPES[mixer.get_init()[1]][1]
+        frames += numpy.random.default_rng().uniform(-1, 1, frames.shape).astype(numpy.float32) * (1 - ramp) * (STATIC_LEVEL * full_scale)
+    return split_blocks(array_to_pcm(frames), block_bytes)
+
+
+def get_state_file(settings_file):
+    # Playback state snapshots are kept next to the settings file they belong to
+    return os.path.splitext(settings_file)[0] + "_state.json"
+
+
+def load_state(path):
+    # Last playback state snapshot, or an empty one if there is none or it cannot be read
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log.warning("Ignoring playback state '%s': %s", path, e)
+        return {}
+
+
+def split_track_name(path):
+    # Artist and title from an "Artist - Title" file name, or (None, None)
+    name = os.path.splitext(os.path.basename(path))[0]
+    if " - " in name:
+        return tuple(name.split(" - ", 1))
+    return None, None
+
+
+def probe_track(path):
+    # Duration in seconds and artist/title tags of a track; anything that cannot be determined is None
+    info = {"duration": None}
+    info["artist"], info["title"] = split_track_name(path)
+    try:
+        if FFPROBE:
+            command = [FFPROBE, "-v", "quiet", "-print_format", "json", "-show_entries", "format=duration:format_tags=artist,title", path]
+            result = subprocess.run(command, capture_output=True, text=True, timeout=10)
+            details = json.loads(result.stdout).get("format", {})
+            tags = {key.lower(): value for key, value in details.get("tags", {}).items()}
+            info["duration"] = float(details["duration"]) if "duration" in details else None
+            info["artist"] = tags.get("artist", info["artist"])
+            info["title"] = tags.get("title", info["title"])
+        else:
+            # Without ffprobe only what a file's header says is read; decoding every file just for its length
+            # would cost as much as playing it
+            info["duration"] = read_header_duration(path)
+    except Exception:
+        pass
+    return info
+
+
+def read_header_duration(path):
+    # Duration in seconds from a WAV file's header, or None for formats whose length is not in a plain header
+    if not path.lower().endswith(".wav"):
+        return None
+    with wave.open(path, "rb") as f:
+        return f.getnframes() / f.getframerate()
+
+
+def is_network_folder(folder):
+    # True if a folder is on a network filesystem, where inotify misses the changes other machines make
+    try:
+        with open("/proc/mounts") as f:
+            mounts = [(mount.replace("\\040", " "), fstype) for _, mount, fstype, *_ in (line.split() for line in f)]
+    except OSError:
+        return False
+    path = os.path.realpath(folder)
+    containing = [(mount, fstype) for mount, fstype in mounts if path == mount or path.startswith(os.path.join(mount, ""))]
+    return bool(containing) and max(containing, key=lambda mount: len(mount[0]))[1] in NETWORK_FILESYSTEMS
+
+
+def subtree_range(directory):
+    # Bounds of the paths below a directory, for range queries on an indexed path column
+    prefix = os.path.join(directory, "")
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class MediaLibrary:
+    # SQLite index of audio files that only rescans directories whose mtime changed
+    def __init__(self, path=LIBRARY_FILE, extensions=AUDIO_EXTENSIONS):
+        self.extensions = tuple(extension.lower() for extension in extensions)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, parent TEXT, mtime REAL);
+            CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, directory TEXT, mtime REAL, size INTEGER,
+                                              format TEXT, duration REAL, artist TEXT, title TEXT);
+            CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+        """)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(files)")}
+        with self.db:
+            if "loudness" not in columns:
+                self.db.execute("ALTER TABLE files ADD COLUMN loudness REAL")
+            if "analyzed" not in columns:
+                self.db.execute("ALTER TABLE files ADD COLUMN analyzed INTEGER NOT NULL DEFAULT 0")
+            if "probed" not in columns:
+                self.db.execute("ALTER TABLE files ADD COLUMN probed INTEGER NOT NULL DEFAULT 0")
+                self.db.execute("UPDATE files SET probed = 1 WHERE duration IS NOT NULL")
+
+    def scan(self, folder, recursive=True, force=False):
+        # Bring the index for a folder up to date and return the (added, removed) file paths
+        added, removed = [], []
+        top = os.path.normpath(folder)
+        pending = [top]
+        with self.lock, self.db:
+            while pending:
+                directory = pending.pop()
+                try:
+                    mtime = os.stat(directory).st_mtime
+                except OSError:
+                    self.forget_directory(directory, removed)
+                    continue
+                row = self.db.execute("SELECT mtime FROM directories WHERE path = ?", (directory,)).fetchone()
+                if row and row[0] == mtime and not (force and directory == top):
+                    # Nothing was added or removed here, only its subdirectories can have changed
+                    if recursive:
+                        pending.extend(child for child, in self.db.execute("SELECT path FROM directories WHERE parent = ?", (directory,)))
+                    continue
+                subdirectories = self.scan_directory(directory, mtime, added, removed)
+                if recursive:
+                    pending.extend(subdirectories)
+        return added, removed
+
+    def scan_directory(self, directory, mtime, added, removed):
+        # List one directory, sync its files and subdirectories with the index and return the subdirectories
+        known = {path: (file_mtime, size) for path, file_mtime, size in self.db.execute("SELECT path, mtime, size FROM files WHERE directory = ?", (directory,))}
+        known_subdirectories = {path for path, in self.db.execute("SELECT path FROM directories WHERE parent = ?", (directory,))}
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.name.lower().endswith(self.extensions) and entry.is_file():
+                    stat = entry.stat()
+                    state = known.pop(entry.path, None)
+                    if state is None:
+                        added.append(entry.path)
+                    elif state == (stat.st_mtime, stat.st_size):
+                        continue
+                    # New or changed file: store it without details, the duration prober probes it again
+                    self.db.execute("INSERT OR REPLACE INTO files (path, directory, mtime, size, format) VALUES (?, ?, ?, ?, ?)",
+                                    (entry.path, directory, stat.st_mtime, stat.st_size, os.path.splitext(entry.name)[1][1:].lower()))
+        for path in known:
+            self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+            removed.append(path)
+        for path in known_subdirectories.difference(subdirectories):
+            self.forget_directory(path, removed)
+        for path in subdirectories:
+            # Record subdirectories without an mtime so they get scanned
+            self.db.execute("INSERT OR IGNORE INTO directories (path, parent, mtime) VALUES (?, ?, NULL)", (path, directory))
+        self.db.execute("INSERT OR REPLACE INTO directories (path, parent, mtime) VALUES (?, ?, ?)", (directory, os.path.dirname(directory), mtime))
+        return subdirectories
+
+    def forget_directory(self, directory, removed):
+        # Drop a directory that no longer exists and everything below it from the index
+        low, high = subtree_range(directory)
+        removed.extend(path for path, in self.db.execute("SELECT path FROM files WHERE directory = ? OR (path >= ? AND path < ?)", (directory, low, high)))
+        self.db.execute("DELETE FROM files WHERE directory = ? OR (path >= ? AND path < ?)", (directory, low, high))
+        self.db.execute("DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)", (directory, low, high))
+
+    def tracks(self, folder, recursive=True):
+        # Paths of the indexed files in a folder, including its subfolders if recursive
+        directory = os.path.normpath(folder)
+        with self.lock:
+            if recursive:
+                rows = self.db.execute("SELECT path FROM files WHERE path >= ? AND path < ? ORDER BY path", subtree_range(directory))
+            else:
+                rows = self.db.execute("SELECT path FROM files WHERE directory = ? ORDER BY path", (directory,))
+            return [path for path, in rows]
+
+    def details(self, path):
+        # Stored duration, artist and title of a file, probing and storing them the first time
+        with self.lock:
+            row = self.db.execute("SELECT duration, artist, title, probed FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[3]:
+            return {"duration": row[0], "artist": row[1], "title": row[2]}
+        info = probe_track(path)
+        with self.lock, self.db:
+            self.db.execute("UPDATE files SET duration = ?, artist = ?, title = ?, probed = 1 WHERE path = ?",
+                            (info["duration"], info["artist"], info["title"], path))
+        return info
+
+    def duration(self, path):
+        # Stored duration of a file in seconds, or None if it has not been probed (yet); never probes the file
+        with self.lock:
+            row = self.db.execute("SELECT duration FROM files WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def pending_details(self, folder, limit):
+        # Up to limit files in a folder that have not been probed yet
+        with self.lock:
+            return [path for path, in self.db.execute("SELECT path FROM files WHERE probed = 0 AND path >= ? AND path < ? LIMIT ?",
+                                                      (*subtree_range(os.path.normpath(folder)), limit))]
+
+    def pending_analysis(self, folder, limit):
+        # Up to limit files in a folder whose loudness has not been analyzed yet
+        with self.lock:
+            return [path for path, in self.db.execute("SELECT path FROM files WHERE analyzed = 0 AND path >= ? AND path < ? LIMIT ?",
+                                                      (*subtree_range(os.path.normpath(folder)), limit))]
+
+    def set_loudness(self, path, loudness):
+        # Store the analyzed loudness of a file (None if it could not be measured)
+        with self.lock, self.db:
+            self.db.execute("UPDATE files SET loudness = ?, analyzed = 1 WHERE path = ?", (loudness, path))
+
+    def loudness(self, path):
+        # Analyzed loudness of a file in LUFS, or None
+        with self.lock:
+            row = self.db.execute("SELECT loudness FROM files WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def artist(self, path):
+        # Stored artist of a file, falling back to its file name; never probes the file
+        with self.lock:
+            row = self.db.execute("SELECT artist FROM files WHERE path = ?", (path,)).fetchone()
+        return row[0] if row and row[0] else split_track_name(path)[0]
+
+    def close(self):
+        # Close the database connection
+        with self.lock:
+            self.db.close()
+
+
+class RampVoiceLines:
+    # Voice line policy: the chance of an intermission after a song grows by step with every song of the cycle
+    # that has not been balanced by an intermission yet (songs so far minus voice lines so far, as it always was)
+    def __init__(self, step=0.1):
+        self.step = step
+
+    def should_insert(self, songs_ahead, rng):
+        return rng.random() < min(self.step * (songs_ahead + 1), 1.0)
+
+
+class RotationRule:
+    # Base class for rotation rules; a rule can turn down a candidate song given the recent history
+    def accept(self, track, history):
+        return True
+
+
+class NoRepeatWindow(RotationRule):
+    # Keep a song from coming back within the last window songs, across playlist cycles
+    def __init__(self, window):
+        self.window = window
+
+    def accept(self, track, history):
+        return track not in itertools.islice(reversed(history), self.window)
+
+
+class ArtistSeparation(RotationRule):
+    # Keep an artist from playing twice within the last window songs
+    def __init__(self, window, artist_of):
+        self.window = window
+        self.artist_of = artist_of
+        self.artists = {}
+
+    def artist(self, track):
+        if track not in self.artists:
+            self.artists[track] = self.artist_of(track)
+        return self.artists[track]
+
+    def accept(self, track, history):
+        artist = self.artist(track)
+        return artist is None or all(self.artist(previous) != artist for previous in itertools.islice(reversed(history), self.window))
+
+
+class FolderWeights:
+    # Weighted rotation: songs in the given subfolders are entered into each cycle several times
+    def __init__(self, folder, weights):
+        self.weights = [(os.path.join(os.path.normpath(folder), subfolder, ""), int(weight)) for subfolder, weight in weights.items()]
+
+    def __call__(self, track):
+        for prefix, weight in self.weights:
+            if track.startswith(prefix):
+                return weight
+        return 1
+
+
+class LazyShuffle:
+    # Fisher-Yates shuffle done one draw at a time, so nothing is shuffled before it is needed
+    def __init__(self, items, rng):
+        self.items = list(items)
+        self.rng = rng
+        self.cursor = 0
+        self.removed = set()
+
+    def __len__(self):
+        return len(self.items) - self.cursor
+
+    def draw(self, accept=None):
+        # Take a random remaining item, preferring ones accept() agrees to; None when exhausted
+        while self.cursor < len(self.items):
+            for attempt in range(ROTATION_TRIES):
+                pick = self.rng.randrange(self.cursor, len(self.items))
+                if accept is None or self.items[pick] in self.removed or accept(self.items[pick]):
+                    break
+            self.items[self.cursor], self.items[pick] = self.items[pick], self.items[self.cursor]
+            item = self.items[self.cursor]
+            self.cursor += 1
+            if item not in self.removed:
+                return item
+        return None
+
+    def add(self, item):
+        # Add an item to the remaining ones
+        self.removed.discard(item)
+        self.items.append(item)
+
+    def remove(self, item):
+        # Make sure an item is not drawn any more
+        self.removed.add(item)
+
+
+class PlaylistEngine:
+    # Generates one cycle of a station's playlist lazily, in O(1) per track, from a seeded random generator
+    def __init__(self, songs, voice_lines, rng, rules=(), voice_line_policy=None, weight_of=None, history=None):
+        self.rng = rng
+        if weight_of is not None:
+            songs = [song for song in songs for _ in range(max(weight_of(song), 0))]
+        self.songs = LazyShuffle(songs, rng)
+        self.voice_lines = LazyShuffle(voice_lines, rng)
+        self.rules = list(rules)
+        self.voice_line_policy = voice_line_policy or RampVoiceLines()
+        self.history = history if history is not None else deque(maxlen=PLAYLIST_HISTORY)
+        self.start_history = list(self.history)  # History as the cycle started, which replaying the cycle starts from
+        self.drawn = 0  # Tracks generated so far
+
+    def accept(self, track):
+        return all(rule.accept(track, self.history) for rule in self.rules)
+
+    def __iter__(self):
+        songs_drawn = 0
+        voice_lines_used = 0
+        while True:
+            song = self.songs.draw(self.accept if self.rules else None)
+            if song is None:
+                break
+            self.history.append(song)
+            self.drawn += 1
+            yield song
+            if len(self.voice_lines) and self.voice_line_policy.should_insert(songs_drawn - voice_lines_used, self.rng):
+                voice_line = self.voice_lines.draw()
+                if voice_line is not None:
+                    self.drawn += 1
+                    yield voice_line
+                    voice_lines_used += 1
+            songs_drawn += 1
+        # Voice lines that were not used between songs close the cycle, as they always have
+        while True:
+            voice_line = self.voice_lines.draw()
+            if voice_line is None:
+                break
+            self.drawn += 1
+            yield voice_line
+
+    def add(self, track, voice_line=False):
+        # Make a newly found file part of the rest of this cycle
+        (self.voice_lines if voice_line else self.songs).add(track)
+
+    def remove(self, track):
+        # Keep a removed file out of the rest of this cycle
+        self.songs.remove(track)
+        self.voice_lines.remove(track)
+
+
+def minute_of_week(moment):
+    # Local minutes since Monday 00:00 of a time.time() value
+    t = time.localtime(moment)
+    return t.tm_wday * 1440 + t.tm_hour * 60 + t.tm_min + t.tm_sec / 60
+
+
+def parse_clock(text):
+    # Minutes since midnight of an "HH:MM" time
+    hours, minutes = text.split(":")
+    if not (0 <= int(hours) < 24 and 0 <= int(minutes) < 60):
+        raise ValueError(f"Invalid time '{text}'")
+    return int(hours) * 60 + int(minutes)
+
+
+class ProgramSchedule:
+    # A station's weekly programming: show blocks looked up by binary search on the minute of the week,
+    # a jingle at the top of every hour and ad breaks at set minutes past the hour
+    def __init__(self, program):
+        intervals = []  # (begin, end, minute of the week the show started, block)
+        for block in program.get("blocks", []):
+            start, end = parse_clock(block["start"]), parse_clock(block["end"])
+            length = (end - start) % 1440 or 1440  # A block ending at or before its start runs past midnight
+            for day in block.get("days", PROGRAM_DAYS):
+                begin = PROGRAM_DAYS.index(day[:3].lower()) * 1440 + start
+                # A block that runs past Sunday midnight continues at the start of the week
+                intervals += [(begin, min(begin + length, 10080), begin, block), (0, begin + length - 10080, begin - 10080, block)]
+        intervals = [interval for interval in intervals if interval[1] > interval[0]]
+        # Cut the week at every start and end, so the intervals looked up never overlap: where blocks overlap,
+        # the one that started last is on air, and a longer block it interrupted carries on after it ends
+        self.starts, self.ends, self.blocks = [], [], []
+        points = sorted({point for begin, end, started, block in intervals for point in (begin, end)})
+        for begin, end in zip(points, points[1:]):
+            on_air = [interval for interval in intervals if interval[0] <= begin and end <= interval[1]]
+            if not on_air:
+                continue
+            block = max(on_air, key=lambda interval: interval[2])[3]
+            if self.blocks and self.blocks[-1] is block and self.ends[-1] == begin:
+                self.ends[-1] = end
+            else:
+                self.starts.append(begin)
+                self.ends.append(end)
+                self.blocks.append(block)
+        self.jingles_folder = program.get("jingles_folder", "")
+        self.ads_folder = program.get("ads_folder", "")
+        self.breaks = sorted({int(minute) % 60 for minute in program.get("ad_breaks", [])})
+        self.ads_per_break = int(program.get("ads_per_break", ADS_PER_BREAK))
+
+    def block_at(self, moment):
+        # The show block on air at a time.time() value, or None between shows
+        minute = minute_of_week(moment)
+        i = bisect.bisect_right(self.starts, minute) - 1
+        return self.blocks[i] if i >= 0 and minute < self.ends[i] else None
+
+    def breaks_between(self, since, until):
+        # (ad break due, jingle due) for the time between two time.time() values
+        minutes = (until - since) / 60
+        minute = minute_of_week(since) % 60
+        jingle = bool(self.jingles_folder) and (minutes >= 60 or minute + minutes >= 60)
+        if not self.ads_folder or not self.breaks:
+            return False, jingle
+        i = bisect.bisect_right(self.breaks, minute)
+        next_break = self.breaks[i] if i < len(self.breaks) else self.breaks[0] + 60
+        return next_break - minute <= minutes, jingle
+
+    def folders(self):
+        # Every folder the programming plays from
+        return [folder for block in self.blocks for folder in (block.get("songs_folder"), block.get("voice_lines_folder")) if folder] + \
+            [folder for folder in (self.jingles_folder, self.ads_folder) if folder]
+
+
+class VoiceLineBank:
+    # Every short voice line of a folder, decoded once into a single memory-mapped buffer of at most limit bytes
+    def __init__(self, folder, limit=VOICE_BANK_LIMIT):
+        self.folder = folder
+        self.limit = limit
+        self.clips = {}  # (start, length) of each clip in the buffer by path
+        self.view = None
+        self.nbytes = 0
+        self.ready = False
+
+    def load(self, paths):
+        # Worker: decode the voice lines one after another into a temporary file and map it
+        block_bytes = get_block_bytes()
+        limit = get_block_bytes(VOICE_LINE_MAX_SECONDS)
+        clips = {}
+        with tempfile.TemporaryFile() as f:
+            for path in paths:
+                start = f.tell()
+                if self.append_clip(f, path, block_bytes, limit) and f.tell() <= self.limit:
+                    clips[path] = (start, f.tell() - start)
+                else:
+                    # Too long, unreadable or past the bank's limit, so it is streamed like a song instead
+                    f.seek(start)
+                    f.truncate()
+            size = f.tell()
+            if size:
+                f.flush()
+                self.view = memoryview(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ))
+        self.clips = clips
+        self.nbytes = size
+        self.ready = True
+        log.info("Voice line bank for '%s': %d clips, %.1f MB", self.folder, len(clips), size / 1048576)
+
+    def append_clip(self, f, path, block_bytes, limit):
+        # Write one clip's PCM to the file, giving up once it is longer than limit bytes; clips are not put in the
+        # disk cache, since the bank already keeps them decoded
+        start = f.tell()
+        blocks = iter_pcm_blocks(path, block_bytes)
+        try:
+            for block in blocks:
+                f.write(block)
+                if f.tell() - start > limit:
+                    return False
+            return True
+        except Exception:
+            return False
+        finally:
+            blocks.close()
+
+    def __contains__(self, path):
+        return self.ready and path in self.clips
+
+    def blocks(self, path, block_bytes, offset=0):
+        # Zero-copy views of a clip's PCM, block by block, starting offset seconds in
+        start, length = self.clips[path]
+        end = start + length
+        return [self.view[position:min(position + block_bytes, end)] for position in range(start + get_offset_bytes(offset), end, block_bytes)]
+
+
+class TrackStream:
+    # Decodes one track in the background into a bounded ring of PCM blocks, at the track's loudness normalization
+    # gain, so the gain never carries over to the tail of the previous track that is still playing
+    def __init__(self, path, head=None, offset=0, cache=None, max_blocks=RING_BLOCKS, gain=1.0):
+        self.path = path
+        self.offset = offset
+        self.cache = cache
+        self.gain = gain
+        self.block_bytes = get_block_bytes()
+        self.blocks = queue.Queue(maxsize=max(max_blocks, len(head.blocks) if head else 0))
+        self.ready = threading.Event()
+        self.finished = False
+        self.stopped = False
+        self.error = None
+        self.skip = 0
+        self.pending = deque()  # Reworked blocks (crossfades, tuning) played before the ring buffer
+        self.created = time.perf_counter()
+        self.first_block_seconds = None  # Time from creating the stream until its first block was buffered
+        self.decode_seconds = 0.0  # Time spent decoding, not counting waits for room in the ring buffer
+        self.thread = None
+        if head:
+            # Start from the prefetched leading blocks and only decode what comes after them
+            for block in head.blocks:
+                self.blocks.put_nowait(apply_gain(block, gain))
+            self.skip = len(head.blocks)
+            self.first_block_seconds = 0.0
+            self.ready.set()
+            if head.complete:
+                self.finished = True
+                return
+        self.thread = threading.Thread(target=self.decode, daemon=True)
+        self.thread.start()
+
+    def decode(self):
+        # Decoder thread: fill the ring buffer until the track ends or the stream is closed
+        blocks = iter_pcm_blocks(self.path, self.block_bytes, self.offset, self.cache)
+        try:
+            started = time.perf_counter()
+            for index, block in enumerate(blocks):
+                self.decode_seconds += time.perf_counter() - started
+                if index >= self.skip and not self.put(apply_gain(block, self.gain)):
+                    break
+                started = time.perf_counter()
+        except Exception as e:
+            self.error = e
+        finally:
+            blocks.close()
+            self.finished = True
+            self.ready.set()
+
+    def put(self, block):
+        # Block until there is room in the ring buffer, giving up if the stream is closed
+        while not self.stopped:
+            try:
+                self.blocks.put(block, timeout=0.1)
+                if self.first_block_seconds is None:
+                    self.first_block_seconds = time.perf_counter() - self.created
+                self.ready.set()
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def next_block(self):
+        # The next block to play, or None if nothing is buffered
+        if self.pending:
+            return self.pending.popleft()
+        try:
+            return self.blocks.get_nowait()
+        except queue.Empty:
+            return None
+
+    def feed(self, channel, encoder=None):
+        # Keep the channel playing one block with the next one queued behind it, passing each block on to the
+        # station's broadcast encoder, if it has one
+        while channel.get_queue() is None:
+            block = self.next_block()
+            if block is None:
+                break
+            if encoder:
+                encoder.put(block)
+            sound = mixer.Sound(buffer=block)
+            if channel.get_busy():
+                channel.queue(sound)
+            else:
+                channel.play(sound)
+
+    def take_head(self, nbytes):
+        # Take at least nbytes worth of the next blocks, or as many as are buffered
+        head = []
+        while sum(len(block) for block in head) < nbytes:
+            block = self.next_block()
+            if block is None:
+                break
+            head.append(block)
+        return head
+
+    def crossfade_from(self, tail):
+        # Mix the last blocks of the previous track into the start of this one
+        head = self.take_head(sum(len(block) for block in tail))
+        self.pending.extendleft(reversed(crossfade_blocks(tail, head, self.block_bytes)))
+
+    def tune_in(self, seconds, static):
+        # Fade the start of this stream in, as if tuning in to the station
+        head = self.take_head(get_block_bytes(seconds))
+        if head:
+            self.pending.extendleft(reversed(tune_in_blocks(head, self.block_bytes, static)))
+
+    def drain(self):
+        # Take every buffered block, e.g. to crossfade them into the next track
+        blocks = []
+        while True:
+            block = self.next_block()
+            if block is None:
+                return blocks
+            blocks.append(block)
+
+    @property
+    def buffered(self):
+        # Number of blocks waiting to be handed to the channel
+        return len(self.pending) + self.blocks.qsize()
+
+    @property
+    def done(self):
+        # True once every decoded block has been handed to the channel
+        return self.finished and not self.pending and self.blocks.empty()
+
+    def close(self):
+        # Stop the decoder thread and drop any buffered blocks
+        self.stopped = True
+        while True:
+            try:
+                self.blocks.get_nowait()
+            except queue.Empty:
+                break
+
+
+class PrefetchedHead:
+    # Leading decoded blocks of a track; complete when they cover the whole track
+    def __init__(self, blocks, complete):
+        self.blocks = blocks
+        self.complete = complete
+        self.nbytes = sum(len(block) for block in blocks)
+
+
+class Prefetcher:
+    # Decodes the start of upcoming tracks on a worker pool so track changes have no gap
+    def __init__(self, workers=PREFETCH_WORKERS, budget=PREFETCH_BUDGET, cache=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.audio_cache = cache
+        self.budget = budget
+        self.cache = OrderedDict()  # Prefetched heads by path, least recently used first
+        self.cache_bytes = 0
+        self.pending = {}  # Futures by station, then by path; a station is any key, e.g. (engine, station index)
+        self.generations = {}  # Bumped for a station whenever its queued work is cancelled
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def schedule(self, station, paths):
+        # Queue the given upcoming tracks of a station for decoding
+        with self.lock:
+            generation = self.generations.get(station, 0)
+            pending = self.pending.setdefault(station, {})
+            for path in paths:
+                if path in self.cache:
+                    self.cache.move_to_end(path)
+                elif path not in pending:
+                    pending[path] = self.pool.submit(self.decode_head, station, generation, path)
+
+    def decode_head(self, station, generation, path):
+        # Worker: decode the first PREFETCH_BLOCKS blocks of a track
+        head = []
+        complete = True
+        blocks = iter_pcm_blocks(path, get_block_bytes(), cache=self.audio_cache)
+        try:
+            for block in blocks:
+                if self.generations.get(station, 0) != generation:
+                    return
+                if len(head) == PREFETCH_BLOCKS:
+                    complete = False
+                    break
+                head.append(block)
+        except Exception:
+            # Leave the error for the track's own stream to report when it plays
+            return
+        finally:
+            blocks.close()
+            with self.lock:
+                if self.generations.get(station, 0) == generation:
+                    self.pending.get(station, {}).pop(path, None)
+        with self.lock:
+            if self.generations.get(station, 0) == generation:
+                self.store(path, PrefetchedHead(head, complete))
+
+    def store(self, path, head):
+        # Add a head to the cache, evicting the least recently used ones to stay in budget
+        if head.nbytes > self.budget:
+            return
+        while self.cache and self.cache_bytes + head.nbytes > self.budget:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted.nbytes
+        self.cache[path] = head
+        self.cache_bytes += head.nbytes
+
+    def take(self, path):
+        # Hand over the prefetched head for a track, or None if it was not ready in time
+        with self.lock:
+            head = self.cache.pop(path, None)
+            if head:
+                self.cache_bytes -= head.nbytes
+                self.hits += 1
+            else:
+                self.misses += 1
+            return head
+
+    def evict(self, path):
+        # Forget the prefetched head of a track, e.g. because the file was removed
+        with self.lock:
+            head = self.cache.pop(path, None)
+            if head:
+                self.cache_bytes -= head.nbytes
+
+    def cancel(self, station):
+        # Drop queued and running work for a station, e.g. after its playlist is reshuffled
+        with self.lock:
+            self.generations[station] = self.generations.get(station, 0) + 1
+            for future in self.pending.pop(station, {}).values():
+                future.cancel()
+
+    def shutdown(self):
+        # Stop the worker pool without waiting for running decodes
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class Inotify:
+    # Minimal ctypes binding to the Linux inotify API
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.inotify_add_watch = libc.inotify_add_watch
+        self.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.inotify_rm_watch = libc.inotify_rm_watch
+        self.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.directories = {}  # Watched directory by watch descriptor
+        self.descriptors = {}  # Watch descriptor by watched directory
+
+    def add_watch(self, directory):
+        # Start watching a single directory
+        descriptor = self.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if descriptor < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch '{directory}'")
+        self.directories[descriptor] = directory
+        self.descriptors[directory] = descriptor
+
+    def remove_watch(self, directory):
+        # Stop watching a single directory
+        descriptor = self.descriptors.pop(directory, None)
+        if descriptor is not None:
+            self.directories.pop(descriptor, None)
+            self.inotify_rm_watch(self.fd, descriptor)
+
+    def read(self, timeout):
+        # Wait up to timeout seconds and return the pending (directory, name, mask) events
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b"\0"))
+            offset += 16 + length
+            directory = self.directories.get(descriptor)
+            if mask & IN_IGNORED:
+                # The kernel dropped the watch because the directory is gone
+                self.directories.pop(descriptor, None)
+                self.descriptors.pop(directory, None)
+            elif directory is not None:
+                events.append((directory, name, mask))
+        return events
+
+    def close(self):
+        # Release the inotify file descriptor
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    # Watches station folders and rescans changed directories into the library once they settle
+    def __init__(self, library, debounce=WATCH_DEBOUNCE, poll_interval=WATCH_POLL_INTERVAL):
+        self.library = library
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.changes = queue.Queue()  # (added, removed) path lists waiting for the main thread
+        self.roots = set()  # Folders being watched
+        self.polled = set()  # Folders rescanned periodically because inotify could not watch them
+        self.dirty = {}  # Time of the last event by changed directory
+        self.last_poll = time.monotonic()
+        self.lock = threading.Lock()
+        self.stopped = False
+        try:
+            self.inotify = Inotify() if sys.platform.startswith("linux") else None
+        except (OSError, AttributeError):
+            self.inotify = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def set_folders(self, folders):
+        # Watch exactly the given folders (and their subfolders)
+        folders = {os.path.normpath(folder) for folder in folders if folder and os.path.isdir(folder)}
+        with self.lock:
+            for root in self.roots - folders:
+                self.unwatch_tree(root)
+            for root in folders - self.roots:
+                self.watch_tree(root)
+                if is_network_folder(root):
+                    # inotify only sees changes made on this machine, so network folders are polled as well
+                    self.polled.add(root)
+            self.roots = folders
+
+    def watch_tree(self, root):
+        # Add inotify watches for a folder and every folder below it, falling back to polling
+        if self.inotify is None:
+            self.polled.add(root)
+            return
+        try:
+            for directory, _, _ in os.walk(root):
+                self.inotify.add_watch(directory)
+        except OSError:
+            # Typically the inotify watch limit; polling still picks up changes
+            self.polled.add(root)
+
+    def unwatch_tree(self, root):
+        # Remove the watches for a folder and every folder below it
+        self.polled.discard(root)
+        if self.inotify is not None:
+            low, high = subtree_range(root)
+            for directory in [d for d in self.inotify.descriptors if d == root or low <= d < high]:
+                self.inotify.remove_watch(directory)
+
+    def run(self):
+        # Watcher thread: collect events, wait for them to settle and rescan the changed directories
+        while not self.stopped:
+            events = self.inotify.read(0.5) if self.inotify else []
+            if self.inotify is None:
+                time.sleep(0.5)
+            now = time.monotonic()
+            with self.lock:
+                for directory, name, mask in events:
+                    if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                        self.watch_tree(os.path.join(directory, name))
+                    self.dirty[directory] = now
+                if now - self.last_poll >= self.poll_interval:
+                    self.last_poll = now
+                    for root in self.polled:
+                        self.dirty.setdefault(root, now - self.debounce)
+                settled = [directory for directory, changed in self.dirty.items() if now - changed >= self.debounce]
+                for directory in settled:
+                    del self.dirty[directory]
+            for directory in settled:
+                try:
+                    added, removed = self.library.scan(directory, force=True)
+                except (OSError, sqlite3.Error):
+                    continue
+                if added or removed:
+                    self.changes.put((added, removed))
+
+    def drain(self):
+        # Yield the (added, removed) changes found since the last call
+        while True:
+            try:
+                yield self.changes.get_nowait()
+            except queue.Empty:
+                return
+
+    def stop(self):
+        # Stop the watcher thread and release inotify
+        self.stopped = True
+        self.thread.join()
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+class LoudnessAnalyzer:
+    # Works through the library in the background, measuring the loudness of every track once
+    def __init__(self, library, get_folders, workers=LOUDNESS_WORKERS):
+        self.library = library
+        self.get_folders = get_folders
+        # Spawned processes do not inherit the Tk and mixer state of this one
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.stopped = threading.Event()
+        self.analyzed = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        # Analysis thread: hand batches of unanalyzed tracks to the process pool and store the results
+        while not self.stopped.is_set():
+            batch = []
+            for folder in self.get_folders():
+                batch.extend(self.library.pending_analysis(folder, LOUDNESS_BATCH - len(batch)))
+                if len(batch) >= LOUDNESS_BATCH:
+                    break
+            if not batch:
+                self.stopped.wait(LOUDNESS_IDLE)
+                continue
+            try:
+                results = list(self.pool.map(measure_loudness, batch))
+            except Exception as e:
+                log.warning("Loudness analysis stopped: %s", e)
+                return
+            for path, loudness in zip(batch, results):
+                if self.stopped.is_set():
+                    return
+                self.library.set_loudness(path, loudness)
+                self.analyzed += 1
+
+    def stop(self):
+        # Stop after the current batch, without waiting for it
+        self.stopped.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class DurationProber:
+    # Works through the library in the background, probing the duration and tags of every track once, so the
+    # engine thread only ever reads stored durations
+    def __init__(self, library, get_folders):
+        self.library = library
+        self.get_folders = get_folders
+        self.stopped = threading.Event()
+        self.wakeup = threading.Event()  # Set when new tracks may have been added to the library
+        self.probed = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        # Prober thread: probe batches of new tracks, including the ones the folder watcher adds later
+        while not self.stopped.is_set():
+            try:
+                batch = []
+                for folder in self.get_folders():
+                    batch.extend(self.library.pending_details(folder, DURATION_BATCH - len(batch)))
+                    if len(batch) >= DURATION_BATCH:
+                        break
+                if not batch:
+                    self.wakeup.wait(DURATION_IDLE)
+                    self.wakeup.clear()
+                    continue
+                for path in batch:
+                    if self.stopped.is_set():
+                        return
+                    self.library.details(path)
+                    self.probed += 1
+            except sqlite3.Error:
+                return  # The library was closed
+
+    def wake(self):
+        # Look for new tracks now rather than at the next idle check
+        self.wakeup.set()
+
+    def stop(self):
+        # Stop after the current track, without waiting for it
+        self.stopped.set()
+        self.wakeup.set()
+
+
+class HotkeyInput:
+    # Global hotkeys: a single pynput listener queues key presses, and the main thread carries them out
+    def __init__(self, actions):
+        self.actions = actions  # Callback by action name; volume actions are called with the number of presses
+        self.bindings = []  # (key, action name) pairs
+        self.listener = None
+        self.events = deque()  # (action name, monotonic time of the press); appended and popped without a lock
+        self.last_press = {}  # Monotonic time of the last press of each action, for the debounce
+        self.latencies = deque(maxlen=HOTKEY_LATENCY_SAMPLES)  # Seconds from key press to action, most recent last
+        self.handled = 0
+        self.debounced = 0
+        self.coalesced = 0
+
+    def resolve_key(self, name):
+        # pynput key for a key binding: a named key such as "Left", or a single character
+        try:
+            return keyboard.Key[name.lower()]
+        except KeyError:
+            return keyboard.KeyCode.from_char(name)
+
+    def set_bindings(self, key_bindings):
+        # Listen for the given key bindings, replacing the previous listener
+        self.stop()
+        import_keyboard()
+        self.bindings = [(self.resolve_key(name), action) for action, name in key_bindings.items() if action in self.actions and name]
+        listener = keyboard.Listener(on_press=self.on_press)
+        listener.daemon = True
+        listener.start()
+        self.listener = listener
+
+    def on_press(self, key):
+        # Listener thread: queue the action bound to the key, dropping repeats that come too fast
+        now = time.monotonic()
+        for bound, action in self.bindings:
+            if key == bound:
+                if now - self.last_press.get(action, float("-inf")) < HOTKEY_DEBOUNCE:
+                    self.debounced += 1
+                    return
+                self.last_press[action] = now
+                self.events.append((action, now))
+                return
+
+    def drain(self):
+        # Main thread: carry out queued actions in order, merging runs of the same action into one call
+        while self.events:
+            action, pressed = self.events.popleft()
+            count = 1
+            while self.events and self.events[0][0] == action and action in ("volume_up", "volume_down"):
+                self.events.popleft()
+                count += 1
+            self.coalesced += count - 1
+            if action in ("volume_up", "volume_down"):
+                self.actions[action](count)
+            else:
+                self.actions[action]()
+            self.handled += count
+            self.latencies.append(time.monotonic() - pressed)
+
+    def stats(self):
+        # Hotkey counters and press-to-action latency in milliseconds
+        latencies = sorted(self.latencies)
+        return {
+            "handled": self.handled,
+            "debounced": self.debounced,
+            "coalesced": self.coalesced,
+            "latency_ms": {
+                "last": round(self.latencies[-1] * 1000, 1),
+                "mean": round(sum(latencies) / len(latencies) * 1000, 1),
+                "p95": round(latencies[int(len(latencies) * 0.95)] * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1),
+            } if latencies else None,
+        }
 
-class AudioPlayer:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("Game Radio Player v0.2 by Cheryl Green")
-        self.root.geometry("800x300")  # Adjusted resolution
-        self.root.configure(bg="black")
+    def stop(self):
+        # Stop the listener, if any
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+
+
+class TimingSummary:
+    # Count, mean, maximum and recent percentiles of one timing
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=METRICS_SAMPLES)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def summary(self):
+        # Milliseconds, with the percentiles taken over the recent samples
+        recent = sorted(self.recent)
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2),
+            "p50_ms": round(recent[len(recent) // 2] * 1000, 2),
+            "p95_ms": round(recent[int(len(recent) * 0.95)] * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+            "last_ms": round(self.recent[-1] * 1000, 2),
+        }
 
-        # Initialize attributes before loading settings
+
+class Metrics:
+    # Playback timings and gauges, overall and per station; safe to update from any thread
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}  # TimingSummary by (name, station index or None)
+        self.gauges = {}  # Value by (name, station index or None)
+
+    def observe(self, name, seconds, station=None):
+        # Add a timing sample
+        with self.lock:
+            if (name, station) not in self.timings:
+                self.timings[name, station] = TimingSummary()
+            self.timings[name, station].add(seconds)
+
+    def gauge(self, name, value, station=None):
+        # Set the current value of a gauge
+        with self.lock:
+            self.gauges[name, station] = value
+
+    def snapshot(self):
+        # Every timing and gauge, overall ones first, then by station
+        snapshot = {"overall": {}, "stations": {}}
+        with self.lock:
+            items = [(key, timing.summary()) for key, timing in self.timings.items()] + list(self.gauges.items())
+        for (name, station), value in sorted(items, key=lambda item: (item[0][1] is not None, item[0][1] or 0, item[0][0])):
+            (snapshot["overall"] if station is None else snapshot["stations"].setdefault(str(station), {}))[name] = value
+        return snapshot
+
+
+class SnapshotWriter:
+    # Writes JSON snapshots (playback state, metrics) from a background thread; a snapshot replaces the file atomically,
+    # and snapshots taken while one is being written are collapsed into the latest
+    def __init__(self, path):
+        self.path = path
+        self.pending = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, state):
+        # Queue a snapshot to be written
+        with self.lock:
+            self.pending = state
+        self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            with self.lock:
+                state, self.pending = self.pending, None
+            if state is not None:
+                self.save(state)
+            if self.stopped:
+                return
+
+    def save(self, state):
+        # Write to a temporary file first, so a crash never leaves a half-written snapshot behind
+        temp = self.path + ".tmp"
+        try:
+            with open(temp, 'w') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.path)
+        except OSError as e:
+            log.error("Error saving %s: %s", self.path, e)
+
+    def stop(self):
+        # Write the last queued snapshot, then end the thread
+        self.stopped = True
+        self.wake.set()
+        self.thread.join()
+
+
+class PlaybackScheduler:
+    # Owns the single timer that drives playback for every station, on a Tk root or an asyncio loop
+    def __init__(self, schedule, cancel, interval=SCHEDULER_INTERVAL):
+        self.schedule = schedule  # Called with a delay in milliseconds and a callback, returns a handle
+        self.cancel = cancel  # Called with a handle returned by schedule
+        self.interval = interval
+        self.tasks = []  # Callbacks run on every tick
+        self.timers = []  # Heap of (due time, sequence number, callback) one-shot timers
+        self.sequence = 0
+        self.after_id = None
+        self.ticks = 0
+        self.due = None  # Monotonic time the next tick is due
+        self.metrics = None  # Receives tick lag and tick duration when set
+
+    @classmethod
+    def for_tk(cls, root, interval=SCHEDULER_INTERVAL):
+        # Scheduler driven by a Tk root's after() timers
+        return cls(root.after, root.after_cancel, interval)
+
+    @classmethod
+    def for_asyncio(cls, loop, interval=SCHEDULER_INTERVAL):
+        # Scheduler driven by an asyncio event loop
+        return cls(lambda delay, callback: loop.call_later(delay / 1000, callback), lambda handle: handle.cancel(), interval)
+
+    def add_task(self, callback):
+        # Run a callback on every tick
+        self.tasks.append(callback)
+
+    def call_later(self, delay, callback):
+        # Run a callback once, on the first tick at least delay seconds from now
+        self.sequence += 1
+        heapq.heappush(self.timers, (time.monotonic() + delay, self.sequence, callback))
+
+    @property
+    def pending(self):
+        # Number of timer callbacks currently scheduled by the scheduler (never more than one)
+        return 0 if self.after_id is None else 1
+
+    def start(self):
+        # Schedule the next tick unless one is already scheduled
+        if self.after_id is None:
+            self.due = time.monotonic() + self.interval / 1000
+            self.after_id = self.schedule(self.interval, self.tick)
+
+    def stop(self):
+        # Cancel the pending tick
+        if self.after_id is not None:
+            self.cancel(self.after_id)
+            self.after_id = None
+
+    def tick(self):
+        # Run due timers and every task, then schedule the next tick
+        self.after_id = None
+        self.ticks += 1
+        started = time.perf_counter()
+        try:
+            now = time.monotonic()
+            if self.metrics:
+                self.metrics.observe("tick_lag", max(now - self.due, 0.0))
+            while self.timers and self.timers[0][0] <= now:
+                _, _, callback = heapq.heappop(self.timers)
+                callback()
+            for task in self.tasks:
+                task()
+            if self.metrics:
+                self.metrics.observe("tick", time.perf_counter() - started)
+        finally:
+            self.start()
+
+
+class ChannelPool:
+    # Mixer channels handed to stations while they play and reused once they are given back
+    def __init__(self):
+        self.free = []  # Channels ready to be handed out again
+        self.fading = []  # Channels given back while still fading out
+        self.size = 0  # Channels allocated from the mixer so far
+
+    def acquire(self):
+        # A silent channel, allocating another mixer channel only when none is free
+        for channel in [channel for channel in self.fading if not channel.get_busy()]:
+            self.fading.remove(channel)
+            self.free.append(channel)
+        if self.free:
+            return self.free.pop()
+        if mixer.get_num_channels() <= self.size:
+            mixer.set_num_channels(self.size + 1)
+        self.size += 1
+        return mixer.Channel(self.size - 1)
+
+    def release(self, channel):
+        # Take a channel back; one that is still fading out is reused once it falls silent
+        (self.fading if channel.get_busy() else self.free).append(channel)
+
+
+class SharedResources:
+    # The media library, decoded audio cache, mixer channels and background workers of every engine in the process;
+    # engines that play through one mixer or keep their library in one folder must share one
+    def __init__(self, on_error=log.error):
+        self.engines = []  # Engines started on these resources, whose station folders the workers go through
+        try:
+            self.library = MediaLibrary()
+        except sqlite3.Error as e:
+            on_error(f"Error opening media library '{LIBRARY_FILE}', using a temporary one: {e}")
+            self.library = MediaLibrary(":memory:")
+        self.channel_pool = ChannelPool()  # Channels are only allocated for stations that play
+        self.audio_cache = self.open_audio_cache()  # Decoded audio kept on disk for replays
+        self.prefetcher = Prefetcher(cache=self.audio_cache)  # Decodes upcoming tracks in the background
+        # Voice line banks are decoded on their own thread, so a large folder never holds up the prefetches
+        self.voice_bank_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="voice-bank")
+        # Probe the duration of every track in the background as the scans and the watchers add them; playback
+        # only reads the stored durations
+        self.duration_prober = DurationProber(self.library, self.get_station_folders)
+        self.loudness_analyzer = None
+
+    def open_audio_cache(self):
+        # Open the decoded audio cache, or play without one if its folder cannot be used
+        try:
+            return AudioCache()
+        except OSError as e:
+            log.warning("Audio cache disabled: %s", e)
+            return None
+
+    def get_station_folders(self):
+        # Songs and voice lines folders of every engine's stations
+        return [folder for engine in list(self.engines) for folder in engine.get_station_folders()]
+
+    def analyze_loudness(self):
+        # Start measuring the loudness of every track in the background, unless it is running already
+        if self.loudness_analyzer is None:
+            self.loudness_analyzer = LoudnessAnalyzer(self.library, self.get_station_folders)
+
+    def close(self):
+        # Stop the background workers and close the library
+        if self.loudness_analyzer:
+            self.loudness_analyzer.stop()
+        self.duration_prober.stop()
+        self.prefetcher.shutdown()
+        self.voice_bank_pool.shutdown(wait=False, cancel_futures=True)
+        self.library.close()
+
+
+class RadioEngine:
+    # Playback core: stations, playlists, channels and volume, without any user interface
+    def __init__(self, settings_file=SETTINGS_FILE, on_error=None):
+        self.settings_file = settings_file
+        self.state_file = get_state_file(settings_file)
         self.num_stations = 4  # Default number of stations
         self.volumes = [0.5] * self.num_stations  # Default volume level for each station
-        self.key_bindings = {
-            "prev_station": "Left",
-            "next_station": "Right",
-            "volume_up": "Up",
-            "volume_down": "Down",
-            "off": "o"
-        }
         self.stations = []  # Initialize empty stations list
+        self.virtual_radio = True  # Only decode the audible station and keep time for the others
+        self.normalize_loudness = True  # Bring every track to LOUDNESS_TARGET using its analyzed loudness
+        self.crossfade_seconds = CROSSFADE_SECONDS  # Overlap between consecutive tracks
+        self.tuning_static = True  # Play a burst of static when tuning to another station
+        self.on_track_change = None  # Called with a station index when that station starts a track
+        self.on_station_change = None  # Called when the current station changes
+        self.on_station_ready = None  # Called with a station index once it can play at startup
+        self.on_error = on_error  # Called with an error message; errors are logged either way
+        self.status_sources = {}  # Extra status reported by clients, as name: callable
+
+        self.settings = self.load_settings()  # Load settings which might set the stations list
+
+        # Initialize station details with default values where settings do not provide them, so num_stations can be raised
+        del self.stations[self.num_stations:]
+        self.stations += [{"name": f"Custom Station {i+1}", "songs_folder": "", "voice_lines_folder": ""} for i in range(len(self.stations), self.num_stations)]
+        self.volumes = self.volumes[:self.num_stations] + [0.5] * (self.num_stations - len(self.volumes))
+        self.programs = [self.load_program(station) for station in self.stations]  # Weekly programming of each station, if it has one
 
-        self.load_settings()  # Load settings which might set the stations list
-
-        # Initialize station details with default values if not set by settings
-        if not self.stations:
-            self.stations = [{"name": f"Custom Station {i+1}", "songs_folder": "", "voice_lines_folder": ""} for i in range(self.num_stations)]
-        
         self.current_station = 0  # Index of the currently selected station (0 for "Off")
         self.playlists = [[] for _ in range(self.num_stations)]  # List of playlists for each station
         self.current_indices = [0] * self.num_stations  # List of current indices for each station
+        self.playlist_engines = [None] * self.num_stations  # Generator state behind each playlist
+        self.playlist_sources = [iter(()) for _ in range(self.num_stations)]  # Lazily produces the rest of each playlist
+        self.playlist_cycles = [0] * self.num_stations  # Number of playlists built so far for each station
+        self.play_histories = [deque(maxlen=PLAYLIST_HISTORY) for _ in range(self.num_stations)]  # Recent songs for rotation rules
+        self.program_blocks = [None] * self.num_stations  # Show block each station's current playlist was built from
+        self.program_checked = [None] * self.num_stations  # time.time() at which each station's breaks were last checked
+        self.program_pools = [{} for _ in range(self.num_stations)]  # Jingles and ads left to play on each station, by folder
         self.positions = [0] * self.num_stations  # List of current positions for each station
         self.is_playing = [False] * self.num_stations  # Play/pause state for each station
+        self.streams = [None] * self.num_stations  # Streaming decoder for each station's current track
+        self.track_started = [0.0] * self.num_stations  # Monotonic time at which each station's current track started
+        self.track_gains = [1.0] * self.num_stations  # Loudness normalization gain of each station's current track
+        self.live_station = None  # Station that is actually decoding in virtual radio mode
+        self.audible_station = None  # Station that is not muted when virtual radio is off
+        self.ready = [False] * self.num_stations  # Stations that can play: restored from the last run or scanned since startup
+        self.scanned = [False] * self.num_stations  # Stations whose folders have been scanned since startup
+        self.scan_pool = None  # Threads scanning station folders into the library in the background
+        self.started = None  # perf_counter() time at which start() was called
+        self.startup_times = {}  # Milliseconds from the start of start() to the end of each startup phase
+        self.channels = [None] * self.num_stations  # Mixer channel of each station that is playing
+        self.listeners = [0] * self.num_stations  # Broadcast listeners of each station
+        self.encoders = [None] * self.num_stations  # Broadcast encoder of each station that has listeners
+        self.shared = None  # Library, caches and workers, possibly shared with other engines
+        self.owns_shared = False  # Whether the shared resources are this engine's own, to close when it stops
+        self.channel_pool = None
+        self.prefetcher = None
+        self.audio_cache = None
+        self.voice_banks = {}  # Voice line bank by voice lines folder
+        self.voice_bank_pool = None
+        self.library = None
+        self.scheduler = None
+        self.watcher = None
+        self.duration_prober = None
+        self.state_writer = None
+        self.metrics = Metrics()
+        self.metrics_file = self.settings.get("metrics_file")  # Optional file the metrics are also dumped to
+        self.metrics_writer = None
+        self.silent_since = [None] * self.num_stations  # Monotonic time at which a playing station's channel fell silent
+        self.commands = queue.Queue()  # Calls posted from other threads, run on the next scheduler tick
+        self.thread = None  # Thread the engine runs on, set by start()
+
+    def start(self, scheduler, shared=None):
+        # Open the library and mixer and start playing; engines in one process share their resources, which
+        # the engine opens itself otherwise. Station folders are scanned in the background afterwards, and each
+        # station plays once it is ready.
+        self.thread = threading.get_ident()
+        self.started = time.perf_counter()
+
+        # Open the media library index, the audio cache and the background workers
+        self.owns_shared = shared is None
+        self.shared = shared or SharedResources(self.report_error)
+        self.shared.engines.append(self)
+        self.library = self.shared.library
+        self.channel_pool = self.shared.channel_pool
+        self.audio_cache = self.shared.audio_cache
+        self.prefetcher = self.shared.prefetcher
+        self.voice_bank_pool = self.shared.voice_bank_pool
+        self.duration_prober = self.shared.duration_prober
+        self.mark_startup("library")
 
         # Set up pygame mixer
         try:
+            import_mixer()
+            self.mark_startup("import_mixer")
             mixer.init()
-            self.channels = [mixer.Channel(i) for i in range(self.num_stations)]  # Channels for each station
         except Exception as e:
-            messagebox.showerror("Error", f"Error initializing mixer: {e}")
+            self.report_error(f"Error initializing mixer: {e}")
+        self.mark_startup("mixer")
+
+        # A single scheduler polls every station for the end of its track
+        self.scheduler = scheduler
+        self.scheduler.add_task(self.run_commands)
+        self.scheduler.add_task(self.check_music_end)
+        self.scheduler.add_task(self.apply_library_changes)
+        self.scheduler.start()
+
+        # Pick up where the last run left off, then play all stations simultaneously
+        self.restore_state()
+        self.mark_startup("restore")
+        self.scan_pool = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan")
+        self.play_all_stations()
+
+        # Watch the station folders so new and removed files show up without a restart; the first
+        # watches are added in the background, after the station scans
+        self.watcher = FolderWatcher(self.library)
+        self.scan_pool.submit(self.watcher.set_folders, self.get_station_folders())
+
+        # Mute all stations except the current one
+        self.update_station_playback()
+
+        # Snapshot the playback state regularly, so even a crash resumes close to where it happened
+        self.state_writer = SnapshotWriter(self.state_file)
+        self.scheduler.call_later(STATE_INTERVAL, self.save_state)
+
+        # Report metrics regularly
+        self.scheduler.metrics = self.metrics
+        if self.metrics_file:
+            self.metrics_writer = SnapshotWriter(self.metrics_file)
+        self.scheduler.call_later(METRICS_INTERVAL, self.report_metrics)
+
+        # Stations that are silent between shows start playing when their next show begins
+        if any(self.programs):
+            self.scheduler.call_later(PROGRAM_CHECK_INTERVAL, self.check_programs)
+        self.mark_startup("start")
+
+    def mark_startup(self, phase):
+        # Record how long startup took to get to the end of a phase
+        self.startup_times[phase] = round((time.perf_counter() - self.started) * 1000, 1)
+
+    def scan_station(self, station_index):
+        # Scan thread: bring the library up to date with a station's folders at startup, then hand the station to the engine
+        self.scan_station_folders(station_index)
+        self.post(self.station_ready, station_index)
+
+    def scan_station_folders(self, station_index):
+        # Scan thread: bring the library up to date with a station's songs and voice lines folders
+        station = self.stations[station_index]
+        try:
+            for folder in (station['songs_folder'], station['voice_lines_folder']):
+                if folder and os.path.isdir(folder):
+                    self.library.scan(folder)
+        except Exception as e:
+            self.post(self.report_error, f"Error reading folder '{folder}': {e}")
+
+    def station_ready(self, station_index):
+        # A station's folders have been scanned: start playing it, unless it was restored and is playing already
+        self.scanned[station_index] = True
+        self.duration_prober.wake()
+        if not self.ready[station_index]:
+            self.start_station(station_index)
+        if all(self.scanned):
+            self.mark_startup("all_stations")
+            # Measure the loudness of every track in the background, now that startup is over
+            if self.normalize_loudness and import_numpy() is not None and FFMPEG:
+                self.shared.analyze_loudness()
+
+    def start_station(self, station_index):
+        # A station can play: start playing it if it should be playing
+        self.ready[station_index] = True
+        if self.virtual_radio:
+            if self.live_station == station_index or self.listeners[station_index]:
+                self.resume_station(station_index)
+        elif self.playlists[station_index]:
+            self.play_audio(station_index, self.positions[station_index])
+        elif self.programs[station_index] or (self.stations[station_index]['songs_folder'] and os.path.isdir(self.stations[station_index]['songs_folder'])):
+            self.shuffle_and_create_playlist(station_index)
+            self.play_audio(station_index)
+        if "first_station" not in self.startup_times:
+            self.mark_startup("first_station")
+        if self.on_station_ready:
+            self.on_station_ready(station_index)
+
+    def report_error(self, message):
+        # Log an error and hand it to the client, if there is one
+        log.error(message)
+        if self.on_error:
+            self.on_error(message)
+
+    def post(self, callback, *args):
+        # Run a call on the engine's thread at the next scheduler tick; returns a future for its result
+        future = Future()
+        self.commands.put((future, callback, args))
+        return future
+
+    def call(self, callback, *args):
+        # Run a call on the engine's thread: right away when already on it, otherwise at the next tick
+        if threading.get_ident() != self.thread:
+            return self.post(callback, *args)
+        future = Future()
+        try:
+            future.set_result(callback(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def run_commands(self):
+        # Run every call posted from another thread since the last tick
+        while True:
+            try:
+                future, callback, args = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(callback(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def get_channel(self, station_index):
+        # The station's mixer channel, taken from the pool when it starts playing
+        if self.channels[station_index] is None:
+            self.channels[station_index] = self.channel_pool.acquire()
+        return self.channels[station_index]
+
+    def release_channel(self, station_index, fade_ms=0):
+        # Stop (or fade out) a station's channel and give it back to the pool
+        channel = self.channels[station_index]
+        if channel is None:
+            return
+        if fade_ms:
+            channel.fadeout(fade_ms)
+        else:
+            channel.stop()
+        self.channel_pool.release(channel)
+        self.channels[station_index] = None
+
+    def get_station_folders(self):
+        # Every songs and voice lines folder in use
+        return [folder for station in self.stations for folder in (station['songs_folder'], station['voice_lines_folder']) if folder] + \
+            [folder for program in self.programs if program for folder in program.folders()]
+
+    def watch_station_folders(self):
+        # Point the folder watcher at every station's songs and voice lines folders (walking them in the background),
+        # and drop unused voice line banks
+        self.scan_pool.submit(self.watcher.set_folders, self.get_station_folders())
+        in_use = {self.get_playlist_source(i)['voice_lines_folder'] for i in range(self.num_stations)}
+        for folder in [folder for folder in self.voice_banks if folder not in in_use]:
+            del self.voice_banks[folder]
+
+    def set_station_folder(self, station_index, folder_type, folder):
+        # Point a station at another songs or voice lines folder; the folder is scanned in the background, and the
+        # station keeps playing its current playlist until its new one can be built from the library
+        if folder_type == 'songs':
+            self.stations[station_index]['songs_folder'] = folder
+        elif folder_type == 'voice_lines':
+            self.stations[station_index]['voice_lines_folder'] = folder
+        self.scan_pool.submit(self.rescan_station, station_index)
+        self.watch_station_folders()
+
+    def rescan_station(self, station_index):
+        # Scan thread: bring the library up to date with a station's folders, then rebuild its playlist
+        self.scan_station_folders(station_index)
+        self.post(self.reload_station, station_index)
+
+    def rename_station(self, station_index, new_name):
+        # Update the station name
+        self.stations[station_index]['name'] = new_name
+
+    def reload_station(self, station_index):
+        # Rebuild a station's playlist from its folders and carry on playing it if it was audible
+        self.close_stream(station_index)
+        self.release_channel(station_index)
+        self.is_playing[station_index] = False
+        self.shuffle_and_create_playlist(station_index)
+        self.track_started[station_index] = time.monotonic()
+        if not self.virtual_radio or self.live_station == station_index:
+            self.play_audio(station_index)
+
+    def apply_library_changes(self):
+        # Splice files the watcher found added or removed into the upcoming part of each playlist
+        for added, removed in self.watcher.drain():
+            if added:
+                self.duration_prober.wake()
+            for path in removed:
+                self.prefetcher.evict(path)
+            for station_index in range(self.num_stations):
+                if self.virtual_radio and self.playlist_engines[station_index] is None:
+                    continue  # Not tuned in yet; its first playlist will include the change
+                station = self.get_playlist_source(station_index)
+                folders = [os.path.join(os.path.normpath(folder), "") for folder in (station['songs_folder'], station['voice_lines_folder']) if folder]
+                added_here = [path for path in added if path.startswith(tuple(folders))]
+                removed_here = [path for path in removed if path.startswith(tuple(folders))]
+                if not self.playlists[station_index]:
+                    if added_here:
+                        self.reload_station(station_index)
+                    continue
+                # Only the few tracks already taken from the generator need to be looked at
+                engine = self.playlist_engines[station_index]
+                playlist = self.playlists[station_index]
+                upcoming = self.current_indices[station_index] + 1
+                for path in removed_here:
+                    if engine:
+                        engine.remove(path)
+                    try:
+                        del playlist[playlist.index(path, upcoming)]
+                    except ValueError:
+                        pass
+                voice_lines_folder = station['voice_lines_folder'] and os.path.join(os.path.normpath(station['voice_lines_folder']), "")
+                for path in added_here if engine else ():
+                    engine.add(path, voice_line=bool(voice_lines_folder) and path.startswith(voice_lines_folder))
+
+    def get_station_seed(self, station_index):
+        # Seed for a station's playlists, created once and kept in the settings
+        station = self.stations[station_index]
+        if "seed" not in station:
+            station["seed"] = random.randrange(2 ** 32)
+        return station["seed"]
+
+    def get_rotation_rules(self, station):
+        # Build the rotation rules, voice line policy and song weights configured for a station
+        rotation = station.get("rotation", {})
+        rules = []
+        if rotation.get("no_repeat_window"):
+            rules.append(NoRepeatWindow(rotation["no_repeat_window"]))
+        if rotation.get("artist_separation"):
+            rules.append(ArtistSeparation(rotation["artist_separation"], self.library.artist))
+        voice_line_policy = RampVoiceLines(rotation.get("voice_line_step", 0.1))
+        weight_of = FolderWeights(station['songs_folder'], rotation["weights"]) if rotation.get("weights") else None
+        return rules, voice_line_policy, weight_of
+
+    def load_program(self, station):
+        # Parse a station's "program" setting; a station without a valid one just plays its own folders
+        if not station.get("program"):
+            return None
+        try:
+            return ProgramSchedule(station["program"])
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            self.report_error(f"Error in the program of station '{station['name']}': {e}")
+            return None
+
+    def get_playlist_source(self, station_index):
+        # Folders and rotation a station's playlist is built from: its current show block's, falling back to its own
+        station = self.stations[station_index]
+        block = self.program_blocks[station_index]
+        return {**station, **block} if block else station
+
+    def update_program_block(self, station_index):
+        # Look up the show block on air now; True if it is not the one the station's playlist was built from
+        program = self.programs[station_index]
+        block = program.block_at(time.time()) if program else None
+        changed = block is not self.program_blocks[station_index]
+        self.program_blocks[station_index] = block
+        return changed
+
+    def apply_programming(self, station_index, breaks=True):
+        # Follow a station's schedule at a track change: start a new playlist when a show block begins or ends,
+        # and make a due ad break and top-of-hour jingle the next tracks; True if a new playlist was started
+        program = self.programs[station_index]
+        if program is None:
+            return False
+        now = time.time()
+        since = self.program_checked[station_index]
+        self.program_checked[station_index] = now
+        started = False
+        if self.update_program_block(station_index):
+            log.info("Station %d: show %s", station_index + 1, (self.program_blocks[station_index] or {}).get("name", "(none)"))
+            self.shuffle_and_create_playlist(station_index, update_block=False)
+            started = True
+        if breaks and since is not None:
+            ads, jingle = program.breaks_between(since, now)
+            inserts = [self.draw_program_track(station_index, program.ads_folder) for _ in range(program.ads_per_break if ads else 0)]
+            inserts.append(self.draw_program_track(station_index, program.jingles_folder) if jingle else None)
+            index = self.current_indices[station_index]
+            self.playlists[station_index][index:index] = [track for track in inserts if track]
+        return started
+
+    def check_programs(self):
+        # Start the next show on stations left with nothing to play between shows, and schedule the next check
+        for station_index, program in enumerate(self.programs):
+            if not program or not self.ready[station_index] or self.playlists[station_index]:
+                continue
+            if self.virtual_radio and self.live_station != station_index and not self.listeners[station_index]:
+                continue  # Its show is picked up when it is tuned in
+            if self.update_program_block(station_index) and self.program_blocks[station_index]:
+                self.reload_station(station_index)
+        self.scheduler.call_later(PROGRAM_CHECK_INTERVAL, self.check_programs)
+
+    def draw_program_track(self, station_index, folder):
+        # Next jingle or ad from a folder, shuffled without repeats until the folder has been played through
+        pools = self.program_pools[station_index]
+        if folder not in pools or not len(pools[folder]):
+            rng = random.Random(f"{self.get_station_seed(station_index)}:{folder}:{self.playlist_cycles[station_index]}")
+            pools[folder] = LazyShuffle(self.get_audio_files(folder), rng)
+        return pools[folder].draw()
+
+    def shuffle_and_create_playlist(self, station_index, update_block=True):
+        # Start a new playlist cycle for the specified station, from the show on air; tracks are generated as they are needed
+        started = time.perf_counter()
+        if update_block:
+            self.update_program_block(station_index)
+        station = self.get_playlist_source(station_index)
+        self.prefetcher.cancel((self, station_index))
+        songs_files = self.get_audio_files(station['songs_folder'])
+        voice_lines_files = self.get_audio_files(station['voice_lines_folder'])
+        self.load_voice_bank(station['voice_lines_folder'], voice_lines_files)
+        self.create_playlist_engine(station_index, station, songs_files, voice_lines_files)
+        self.playlists[station_index] = []
+        self.current_indices[station_index] = 0
+        self.fill_playlist(station_index, 1 + PREFETCH_AHEAD)
+        self.metrics.observe("playlist_build", time.perf_counter() - started, station_index)
+
+    def create_playlist_engine(self, station_index, station, songs_files, voice_lines_files):
+        # Start the station's next playlist cycle; each cycle has its own seed, so a station's sequence of
+        # playlists can be reproduced
+        rng = random.Random(f"{self.get_station_seed(station_index)}:{self.playlist_cycles[station_index]}")
+        self.playlist_cycles[station_index] += 1
+        rules, voice_line_policy, weight_of = self.get_rotation_rules(station)
+        engine = PlaylistEngine(songs_files, voice_lines_files, rng, rules, voice_line_policy, weight_of, self.play_histories[station_index])
+        self.playlist_engines[station_index] = engine
+        self.playlist_sources[station_index] = iter(engine)
+
+    def resume_cycle(self, station_index, drawn):
+        # Rebuild a restored station's playlist cycle from its seed and the history it started from, using the
+        # library as it was left rather than scanning the folders, and skip the tracks it had already produced
+        station = self.get_playlist_source(station_index)
+        songs_files, voice_lines_files = [self.library.tracks(folder) if folder else [] for folder in (station['songs_folder'], station['voice_lines_folder'])]
+        self.load_voice_bank(station['voice_lines_folder'], voice_lines_files)
+        self.playlist_cycles[station_index] -= 1
+        self.create_playlist_engine(station_index, station, songs_files, voice_lines_files)
+        for _ in itertools.islice(self.playlist_sources[station_index], drawn):
+            pass
+
+    def load_voice_bank(self, folder, voice_lines):
+        # Decode a voice lines folder into a bank in the background, once; later playlists reuse it
+        if folder and voice_lines and folder not in self.voice_banks:
+            bank = VoiceLineBank(folder)
+            self.voice_banks[folder] = bank
+            self.voice_bank_pool.submit(bank.load, voice_lines)
+
+    def voice_bank_memory(self):
+        # Bytes of decoded voice lines held for each station, by station index; stations sharing a folder share its bank
+        banks = [self.voice_banks.get(self.get_playlist_source(i)['voice_lines_folder']) for i in range(self.num_stations)]
+        return [bank.nbytes if bank else 0 for bank in banks]
+
+    def fill_playlist(self, station_index, length):
+        # Pull tracks from the station's playlist generator until the playlist has the given length
+        playlist = self.playlists[station_index]
+        source = self.playlist_sources[station_index]
+        while len(playlist) < length:
+            track = next(source, None)
+            if track is None:
+                break
+            playlist.append(track)
+
+    def get_audio_files(self, folder):
+        # Return the audio files in the specified folder and its subfolders, rescanning only what changed
+        try:
+            if not folder or not os.path.isdir(folder):
+                return []
+            self.library.scan(folder)
+            return self.library.tracks(folder)
+        except Exception as e:
+            self.report_error(f"Error reading folder '{folder}': {e}")
+            return []
+
+    def play_audio(self, station_index, offset=0, tail=None, tune=False):
+        # Play the audio for the given station, starting offset seconds into the track, crossfading
+        # from the tail of the previous track or fading in as if tuning in to the station
+        try:
+            if self.current_indices[station_index] < len(self.playlists[station_index]):
+                playlist = self.playlists[station_index]
+                current_index = self.current_indices[station_index]
+                self.fill_playlist(station_index, current_index + 1 + PREFETCH_AHEAD)
+                current_track = playlist[current_index]
+                self.close_stream(station_index)
+                if not os.path.exists(current_track):
+                    # The file was removed after it was queued; the scheduler moves on to the next one
+                    self.is_playing[station_index] = True
+                    return
+                bank = self.voice_banks.get(self.get_playlist_source(station_index)['voice_lines_folder'])
+                if bank and current_track in bank:
+                    # Intermissions come straight out of the voice line bank: no disk access, no decoding
+                    head = PrefetchedHead(bank.blocks(current_track, get_block_bytes(), offset), complete=True)
+                else:
+                    head = self.prefetcher.take(current_track) if not offset else None
+                self.track_gains[station_index] = self.get_track_gain(current_track)
+                stream = TrackStream(current_track, head, offset, self.audio_cache, gain=self.track_gains[station_index])
+                self.streams[station_index] = stream
+                self.track_started[station_index] = time.monotonic() - offset
+                self.positions[station_index] = offset
+                channel = self.get_channel(station_index)
+                self.apply_volume(station_index)
+                stream.ready.wait(FIRST_BLOCK_TIMEOUT)
+                if tail:
+                    stream.crossfade_from(tail)
+                elif tune and can_mix():
+                    stream.tune_in(TUNING_SECONDS, self.tuning_static)
+                stream.feed(channel, self.encoders[station_index])
+                self.is_playing[station_index] = True
+                self.prefetcher.schedule((self, station_index), [track for track in playlist[current_index + 1:current_index + 1 + PREFETCH_AHEAD] if not (bank and track in bank)])
+                self.notify_track_change(station_index)
+                log.debug("Station %d playing %s from %.1f seconds", station_index, current_track, self.positions[station_index])
+        except Exception as e:
+            self.report_error(f"Error playing audio: {e}")
+
+    def close_stream(self, station_index):
+        # Stop a station's decoder, recording how long its track took to start and to decode, and any decoding error
+        stream = self.streams[station_index]
+        if stream is None:
+            return
+        if stream.error:
+            log.warning("Error decoding %s: %s", stream.path, stream.error)
+        if stream.first_block_seconds is not None:
+            self.metrics.observe("first_block", stream.first_block_seconds, station_index)
+        if stream.thread and stream.finished and not stream.error:
+            self.metrics.observe("decode", stream.decode_seconds, station_index)
+        stream.close()
+        self.streams[station_index] = None
+
+    def notify_track_change(self, station_index):
+        # Tell the client that a station's current track changed
+        if self.on_track_change:
+            self.on_track_change(station_index)
+
+    def get_current_track(self, station_index):
+        # Path of the track a station is on, or None if it has no playlist
+        if self.current_indices[station_index] >= len(self.playlists[station_index]):
+            return None
+        return self.playlists[station_index][self.current_indices[station_index]]
+
+    def describe_track(self, station_index):
+        # Text shown for a station's current track, or None if it has no playlist
+        current_track = self.get_current_track(station_index)
+        if current_track is None:
+            return None
+        program = self.programs[station_index]
+        if program and program.ads_folder and current_track.startswith(os.path.join(os.path.normpath(program.ads_folder), "")):
+            return "Current Song: [Ad Break]"
+        if program and program.jingles_folder and current_track.startswith(os.path.join(os.path.normpath(program.jingles_folder), "")):
+            return "Current Song: [Jingle]"
+        if self.get_playlist_source(station_index)['voice_lines_folder'] in current_track:
+            return "Current Song: [Intermission]"
+        return f"Current Song: {os.path.basename(current_track)}"
+
+    def check_music_end(self):
+        # Check if the music has ended and move to the next track if necessary
+        try:
+            for station_index in range(self.num_stations):
+                stream = self.streams[station_index]
+                if stream:
+                    stream.feed(self.channels[station_index], self.encoders[station_index])
+                if not self.is_playing[station_index]:
+                    continue
+                self.track_silence(station_index)
+                # Move on once the decoder is drained and the last block has been queued, so there is no gap
+                if stream is None or (stream.done and self.channels[station_index].get_queue() is None):
+                    self.next_track(station_index)
+                elif self.is_crossfade_due(stream):
+                    self.next_track(station_index, crossfade=True)
+        except Exception as e:
+            self.report_error(f"Error checking music end: {e}")
+
+    def track_silence(self, station_index):
+        # Measure how long a playing station's channel stays silent (an inter-track gap or a buffer underrun),
+        # to the resolution of a scheduler tick
+        channel = self.channels[station_index]
+        if channel is not None and channel.get_busy():
+            if self.silent_since[station_index] is not None:
+                self.metrics.observe("gap", time.monotonic() - self.silent_since[station_index], station_index)
+                self.silent_since[station_index] = None
+        elif self.silent_since[station_index] is None:
+            self.silent_since[station_index] = time.monotonic()
+
+    def is_crossfade_due(self, stream):
+        # True once all that is left of a fully decoded track is the part to crossfade
+        if self.crossfade_seconds <= 0 or not stream.finished or stream.error or not stream.buffered or not can_mix():
+            return False
+        return stream.buffered * stream.block_bytes <= get_block_bytes(self.crossfade_seconds)
+
+    def next_track(self, station_index, crossfade=False):
+        # Move to the next track in the playlist for the given station
+        try:
+            tail = self.streams[station_index].drain() if crossfade and self.streams[station_index] else None
+            self.current_indices[station_index] += 1
+            self.apply_programming(station_index)
+            self.fill_playlist(station_index, self.current_indices[station_index] + 1)
+            if self.current_indices[station_index] >= len(self.playlists[station_index]):
+                self.shuffle_and_create_playlist(station_index)
+            self.play_audio(station_index, tail=tail)
+        except Exception as e:
+            self.report_error(f"Error switching to next track: {e}")
+
+    def tune(self, station):
+        # Switch to a station by tab index: 0 is "Off", past the last station nothing is audible
+        self.current_station = station
+        self.update_station_playback()
+        if self.on_station_change:
+            self.on_station_change()
+
+    def prev_station(self):
+        # Switch to the previous station, skipping "Off"
+        station = (self.current_station - 1) % (self.num_stations + 1)  # Include "Off"
+        self.tune(station or self.num_stations)
+
+    def next_station(self):
+        # Switch to the next station, skipping "Off"
+        station = (self.current_station + 1) % (self.num_stations + 1)  # Include "Off"
+        self.tune(station or 1)
+
+    def off_station(self):
+        # Switch to "Off"
+        self.tune(0)
+
+    def skip_track(self):
+        # Move the current station on to its next track
+        if 0 < self.current_station <= self.num_stations:
+            self.next_track(self.current_station - 1)
+
+    def get_track_duration(self, track):
+        # Stored duration of a track in seconds, or None until the duration prober has got to it
+        return self.library.duration(track)
+
+    def suspend_station(self, station_index):
+        # Virtual radio: stop decoding a station but remember where its current track started
+        self.close_stream(station_index)
+        self.silent_since[station_index] = None
+        # Let what is already playing fade out in the mixer rather than cutting it off
+        self.release_channel(station_index, int(TUNING_SECONDS * 1000))
+        self.prefetcher.cancel((self, station_index))
+        self.is_playing[station_index] = False
+        self.positions[station_index] = time.monotonic() - self.track_started[station_index]
+
+    def resume_station(self, station_index):
+        # Virtual radio: work out which track and offset a station would be at by now and play from there
+        if not self.ready[station_index]:
+            return  # Resumed by station_ready once its folders have been scanned
+        if not self.playlists[station_index] and self.playlist_engines[station_index] is None and (self.stations[station_index]['songs_folder'] or self.programs[station_index]):
+            # Stations build their first playlist when they are first tuned in
+            self.shuffle_and_create_playlist(station_index)
+        elif self.apply_programming(station_index, breaks=False):
+            # The show changed while the station was not heard; the new one starts as it is tuned in
+            self.track_started[station_index] = time.monotonic()
+        if not self.playlists[station_index]:
+            return
+        elapsed = time.monotonic() - self.track_started[station_index]
+        while True:
+            duration = self.get_track_duration(self.playlists[station_index][self.current_indices[station_index]])
+            if not duration:
+                # Without a known duration the track can only be played from the start
+                elapsed = 0
+                break
+            if elapsed < duration:
+                break
+            elapsed -= duration
+            self.current_indices[station_index] += 1
+            self.fill_playlist(station_index, self.current_indices[station_index] + 1)
+            if self.current_indices[station_index] >= len(self.playlists[station_index]):
+                self.shuffle_and_create_playlist(station_index)
+                if not self.playlists[station_index]:
+                    return
+        self.play_audio(station_index, elapsed, tune=True)
+
+    def switch_live_station(self, station_index):
+        # Virtual radio: make the given station (or none) the only one that decodes
+        if station_index == self.live_station:
+            return
+        # Stations with broadcast listeners keep playing whether or not they are the audible one
+        if self.live_station is not None and not self.listeners[self.live_station]:
+            self.suspend_station(self.live_station)
+        self.live_station = station_index
+        if station_index is not None and not self.listeners[station_index]:
+            self.resume_station(station_index)
+
+    def switch_audible_station(self, station_index):
+        # Virtual radio off: every station keeps playing, but the one left fades out and the one tuned to fades in,
+        # with the same ramps as in virtual radio mode, rather than their volumes snapping
+        previous, self.audible_station = self.audible_station, station_index
+        if station_index == previous:
+            return
+        if previous is not None and self.channels[previous] is not None:
+            # What is playing fades out on the old channel; the station carries on, muted, on a fresh one
+            self.release_channel(previous, int(TUNING_SECONDS * 1000))
+            self.get_channel(previous).set_volume(0)
+        stream = self.streams[station_index] if station_index is not None else None
+        if stream and self.channels[station_index] is not None and can_mix():
+            # Drop the muted blocks already handed to the mixer and fade the station in from the next ones
+            self.release_channel(station_index)
+            stream.tune_in(TUNING_SECONDS, self.tuning_static)
+            stream.feed(self.get_channel(station_index), self.encoders[station_index])
+
+    def add_listener(self, station_index):
+        # A broadcast listener tuned in: start encoding the station for its first listener (in virtual radio mode
+        # the station is played, muted, even when it is not the audible one) and return its encoder
+        self.listeners[station_index] += 1
+        if self.encoders[station_index] is None:
+            self.encoders[station_index] = StationEncoder(BroadcastRing())
+            log.info("Broadcasting station %d", station_index + 1)
+            if self.virtual_radio and self.live_station != station_index:
+                self.resume_station(station_index)
+        return self.encoders[station_index]
+
+    def remove_listener(self, station_index):
+        # A broadcast listener left: stop encoding the station after its last listener
+        self.listeners[station_index] -= 1
+        if self.listeners[station_index] or self.encoders[station_index] is None:
+            return
+        self.encoders[station_index].stop()
+        self.encoders[station_index] = None
+        log.info("Stopped broadcasting station %d", station_index + 1)
+        if self.virtual_radio and self.live_station != station_index:
+            self.suspend_station(station_index)
+
+    def get_track_gain(self, track):
+        # Linear gain that brings a track to LOUDNESS_TARGET, or 1.0 if its loudness is not known (yet)
+        if not self.normalize_loudness:
+            return 1.0
+        loudness = self.library.loudness(track)
+        return 1.0 if loudness is None else 10 ** ((LOUDNESS_TARGET - loudness) / 20)
+
+    def apply_volume(self, station_index):
+        # Set a station's channel to its volume if it is audible, mute it otherwise (in virtual radio mode a station
+        # that is not audible has nothing playing, or is still fading out); track gains are already in the PCM
+        channel = self.channels[station_index]
+        if channel is None:
+            return
+        if station_index == self.current_station - 1:
+            channel.set_volume(self.volumes[station_index])
+        elif not self.virtual_radio or self.listeners[station_index]:
+            channel.set_volume(0)
+
+    def update_station_playback(self):
+        # Adjust the volume for the current station and mute others
+        if self.scheduler is None:
+            return  # Not started yet; start() applies the current station
+        station_index = self.current_station - 1 if 0 < self.current_station <= self.num_stations else None
+        if self.virtual_radio:
+            self.switch_live_station(station_index)
+        else:
+            self.switch_audible_station(station_index)
+        for i in range(self.num_stations):
+            self.apply_volume(i)
+        if 0 < self.current_station <= self.num_stations:
+            self.notify_track_change(self.current_station - 1)
+
+    def change_volume(self, step):
+        # Raise or lower the current station's volume
+        if 0 < self.current_station <= self.num_stations:
+            self.volumes[self.current_station - 1] = min(max(self.volumes[self.current_station - 1] + step, 0.0), 1.0)
+        self.update_station_playback()
+
+    def set_volume(self, val, station_index=None):
+        # Set the volume for the audio playback
+        if station_index is not None:
+            self.volumes[station_index] = min(max(float(val), 0.0), 1.0)
+        self.update_station_playback()
+
+    def status(self):
+        # Snapshot of the engine: current station and what every station is playing
+        now = time.monotonic()
+        voice_bank_memory = self.voice_bank_memory()
+        return {
+            "current_station": self.current_station,
+            "stations": [
+                {
+                    "name": station["name"],
+                    "track": self.get_current_track(i),
+                    "position": round(now - self.track_started[i], 3) if self.playlists[i] else None,
+                    "volume": self.volumes[i],
+                    "live": self.streams[i] is not None,
+                    "show": (self.program_blocks[i] or {}).get("name"),
+                    "listeners": self.listeners[i],
+                    "voice_bank_bytes": voice_bank_memory[i],
+                }
+                for i, station in enumerate(self.stations)
+            ],
+            "startup": self.startup_times,
+            **{name: source() for name, source in self.status_sources.items()},
+        }
+
+    def collect_metrics(self):
+        # Update the buffer and memory gauges and return every metric
+        for i in range(self.num_stations):
+            stream = self.streams[i]
+            bank = self.voice_banks.get(self.get_playlist_source(i)['voice_lines_folder'])
+            if stream is None and bank is None:
+                continue
+            self.metrics.gauge("buffered_blocks", stream.buffered if stream else 0, i)
+            self.metrics.gauge("buffer_fill", round(stream.buffered / RING_BLOCKS, 2) if stream else 0, i)
+            self.metrics.gauge("decoded_bytes", (stream.buffered * stream.block_bytes if stream else 0) + (bank.nbytes if bank else 0), i)
+        for i, encoder in enumerate(self.encoders):
+            if encoder:
+                self.metrics.gauge("broadcast_listeners", self.listeners[i], i)
+                self.metrics.gauge("broadcast_skipped_chunks", encoder.ring.skipped, i)
+                self.metrics.gauge("broadcast_dropped_blocks", encoder.dropped, i)
+        if self.prefetcher:
+            self.metrics.gauge("prefetched_bytes", self.prefetcher.cache_bytes)
+            self.metrics.gauge("prefetch_hits", self.prefetcher.hits)
+            self.metrics.gauge("prefetch_misses", self.prefetcher.misses)
+        if self.audio_cache:
+            self.metrics.gauge("audio_cache_bytes", self.audio_cache.total)
+        self.metrics.gauge("voice_bank_bytes", sum(bank.nbytes for bank in self.voice_banks.values()))
+        return self.metrics.snapshot()
+
+    def report_metrics(self):
+        # Log the metrics, dump them to the metrics file if there is one, and schedule the next report
+        metrics = self.collect_metrics()
+        log.info("metrics %s", json.dumps(metrics))
+        if self.metrics_writer:
+            self.metrics_writer.write(metrics)
+        self.scheduler.call_later(METRICS_INTERVAL, self.report_metrics)
+
+    def handle_command(self, request):
+        # Carry out one control API request; see ControlServer for the commands
+        command = request.get("command")
+        if command == "metrics":
+            return self.collect_metrics()
+        if command == "status":
+            pass
+        elif command == "tune":
+            station = int(request["station"])
+            if not 0 <= station <= self.num_stations + 1:
+                raise ValueError(f"No station {station} to tune to")
+            self.tune(station)
+        elif command == "next":
+            self.next_station()
+        elif command == "prev":
+            self.prev_station()
+        elif command == "off":
+            self.off_station()
+        elif command == "skip":
+            self.skip_track()
+        elif command == "volume":
+            if "value" in request:
+                station = int(request.get("station", self.current_station))
+                if not 1 <= station <= self.num_stations:
+                    raise ValueError(f"No station {station} to set the volume of")
+                self.set_volume(request["value"], station - 1)
+            else:
+                self.change_volume(float(request.get("step", VOLUME_STEP)))
+        else:
+            raise ValueError(f"Unknown command: {command}")
+        return self.status()
+
+    def load_settings(self):
+        # Load the engine's settings from a JSON file and return everything in it, for the client's own settings
+        log.debug("Loading settings from %s", self.settings_file)
+        settings = {}
+        if os.path.exists(self.settings_file):
+            try:
+                with open(self.settings_file, 'r') as f:
+                    settings = json.load(f)
+                    self.num_stations = settings.get("num_stations", self.num_stations)
+                    self.stations = settings.get("stations", self.stations)  # Only overwrite if settings provide stations
+                    self.volumes = settings.get("volumes", [0.5] * self.num_stations)
+                    self.virtual_radio = settings.get("virtual_radio", self.virtual_radio)
+                    self.normalize_loudness = settings.get("normalize_loudness", self.normalize_loudness)
+                    self.crossfade_seconds = settings.get("crossfade_seconds", self.crossfade_seconds)
+                    self.tuning_static = settings.get("tuning_static", self.tuning_static)
+                log.debug("Settings loaded: %s", settings)
+            except json.JSONDecodeError as e:
+                self.report_error(f"Error loading settings: Invalid JSON format. {e}")
+            except Exception as e:
+                self.report_error(f"Error loading settings: {e}")
+        else:
+            log.info("Settings file not found. Using default settings.")
+        return settings
+
+    def save_settings(self, extra=None):
+        # Save the engine's settings, plus the client's own, to a JSON file; other clients' settings are kept
+        settings = dict(self.settings)
+        settings.update({
+            "num_stations": self.num_stations,
+            "stations": self.stations,
+            "volumes": self.volumes,
+            "current_station": self.current_station,
+            "virtual_radio": self.virtual_radio,
+            "normalize_loudness": self.normalize_loudness,
+            "crossfade_seconds": self.crossfade_seconds,
+            "tuning_static": self.tuning_static,
+        })
+        settings.update(extra or {})
+        try:
+            with open(self.settings_file, 'w') as f:
+                json.dump(settings, f)
+            log.debug("Settings saved: %s", settings)
+        except Exception as e:
+            self.report_error(f"Error saving settings: {e}")
+
+    def snapshot_state(self):
+        # Playback state of every station: the tracks taken from its playlist so far and how far into the current one it is
+        now = time.monotonic()
+        stations = []
+        for i in range(self.num_stations):
+            if not self.playlists[i]:
+                stations.append(None)
+                continue
+            station = self.get_playlist_source(i)
+            engine = self.playlist_engines[i]
+            self.positions[i] = now - self.track_started[i]
+            stations.append({
+                "songs_folder": station['songs_folder'],
+                "voice_lines_folder": station['voice_lines_folder'],
+                "cycle": self.playlist_cycles[i],
+                "playlist": self.playlists[i][self.current_indices[i]:],
+                "offset": round(self.positions[i], 3),
+                # The rest of the cycle is replayed from the history it started from and the tracks drawn so far
+                "history": engine.start_history if engine else list(self.play_histories[i]),
+                "drawn": engine.drawn if engine else None,
+                "seed": self.get_station_seed(i),
+            })
+        return {"saved": time.time(), "stations": stations}
+
+    def save_state(self):
+        # Hand a snapshot to the state writer and schedule the next one
+        self.state_writer.write(self.snapshot_state())
+        self.scheduler.call_later(STATE_INTERVAL, self.save_state)
+
+    def restore_state(self):
+        # Put each station back on the track and offset of the last snapshot, without scanning its folders;
+        # the rest of the playlist cycle is replayed from its seed, and a new cycle is only built once it runs out
+        for station_index, saved in enumerate(load_state(self.state_file).get("stations", [])[:self.num_stations]):
+            self.update_program_block(station_index)
+            station = self.get_playlist_source(station_index)
+            if not saved or not saved["playlist"] or (saved["songs_folder"], saved["voice_lines_folder"]) != (station['songs_folder'], station['voice_lines_folder']):
+                continue  # Nothing was playing, or the station has been pointed at other folders (or another show) since
+            self.playlists[station_index] = saved["playlist"]
+            self.current_indices[station_index] = 0
+            self.playlist_cycles[station_index] = saved["cycle"]
+            self.play_histories[station_index].extend(saved["history"])
+            self.positions[station_index] = saved["offset"]
+            # The seed is normally kept in the settings too, unless the last run ended before saving them
+            if saved.get("seed") is not None:
+                self.stations[station_index].setdefault("seed", saved["seed"])
+            if saved.get("drawn") is not None and saved.get("seed") == self.get_station_seed(station_index):
+                self.resume_cycle(station_index, saved["drawn"])
+
+    def stop_playback(self):
+        # Stop the scheduler, every decoder and the prefetch workers, after a last state snapshot
+        if self.state_writer:
+            self.state_writer.write(self.snapshot_state())
+            self.state_writer.stop()
+        if self.metrics_writer:
+            self.metrics_writer.write(self.collect_metrics())
+            self.metrics_writer.stop()
+        if self.scheduler:
+            self.scheduler.stop()
+        if self.watcher:
+            self.watcher.stop()
+        for stream in self.streams:
+            if stream:
+                stream.close()
+        for encoder in self.encoders:
+            if encoder:
+                encoder.stop()
+        if self.scan_pool:
+            self.scan_pool.shutdown(wait=False, cancel_futures=True)
+        if self.shared:
+            for station_index in range(self.num_stations):
+                self.prefetcher.cancel((self, station_index))
+            self.shared.engines.remove(self)
+            if self.owns_shared:
+                self.shared.close()
+            self.shared = None
+
+    def play_all_stations(self):
+        # Start the stations' clocks, play the restored stations and queue the folder scans, the station that
+        # was last heard going first
+        started = time.monotonic()
+        for station_index in range(self.num_stations):
+            if self.virtual_radio:
+                # Stations start keeping time now (from where they were left, if restored); their playlists
+                # are built and decoded once they are tuned in
+                self.track_started[station_index] = started - self.positions[station_index]
+            if self.playlists[station_index]:
+                # Restored stations play straight away; their folders are still scanned for changes afterwards
+                self.start_station(station_index)
+        first = self.settings.get("current_station", 0) - 1
+        for station_index in sorted(range(self.num_stations), key=lambda i: i != first):
+            self.scan_pool.submit(self.scan_station, station_index)
+
+
+class BroadcastRing:
+    # Encoded audio of one broadcast station, kept in a bounded ring that every listener reads from at its own pace
+    def __init__(self, size=BROADCAST_RING):
+        self.chunks = deque(maxlen=size)
+        self.next = 0  # Sequence number of the next chunk to be published
+        self.skipped = 0  # Chunks listeners missed because they fell out of the ring
+        self.lock = threading.Lock()
+        self.waiters = []  # (event loop, future) of listeners waiting for the next chunk
+
+    def publish(self, chunk):
+        # Encoder thread: add a chunk, dropping the oldest, and wake the waiting listeners
+        with self.lock:
+            self.chunks.append(chunk)
+            self.next += 1
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(None))
+            except RuntimeError:
+                pass  # The listener's event loop has been closed
+
+    def start(self):
+        # Sequence number a new listener starts reading at: a short burst behind the newest chunk
+        with self.lock:
+            return max(self.next - BROADCAST_BURST, self.next - len(self.chunks))
+
+    def read(self, cursor):
+        # The chunks from cursor on and the cursor after them; a listener that fell out of the ring skips ahead
+        with self.lock:
+            oldest = self.next - len(self.chunks)
+            if cursor < oldest:
+                skip_to = max(self.next - BROADCAST_BURST, oldest)
+                self.skipped += skip_to - cursor
+                cursor = skip_to
+            return list(itertools.islice(self.chunks, cursor - oldest, None)), self.next
+
+    async def wait(self, cursor):
+        # Wait until there is a chunk past cursor
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if self.next > cursor:
+                return
+            self.waiters.append((loop, future))
+        await future
+
+
+class StationEncoder:
+    # Encodes one station once for all of its broadcast listeners: MP3 through ffmpeg if it is available,
+    # WAV otherwise; blocks come in as they are handed to the station's mixer channel, so it runs in real time
+    def __init__(self, ring):
+        self.ring = ring
+        self.dropped = 0  # Blocks dropped because the encoder fell behind
+        self.blocks = queue.Queue(maxsize=BROADCAST_QUEUE)
+        self.stopped = False
+        self.format = mixer.get_init()
+        self.process = None
+        if FFMPEG and self.format[1] in SAMPLE_FORMATS:
+            frequency, size, channels = self.format
+            command = [FFMPEG, "-v", "quiet", "-f", SAMPLE_FORMATS[size], "-ac", str(channels), "-ar", str(frequency), "-i", "-",
+                       "-f", "mp3", "-b:a", BROADCAST_BITRATE, "-"]
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self.content_type = "audio/mpeg"
+            threading.Thread(target=self.read_encoded, daemon=True).start()
+        else:
+            self.content_type = "audio/wav"
+        threading.Thread(target=self.encode, daemon=True).start()
+
+    def header(self):
+        # Bytes every listener gets before the ring's chunks: a WAV header of unknown length, or nothing for MP3
+        if self.process:
+            return b""
+        frequency, size, channels = self.format
+        frame_bytes = abs(size) // 8 * channels
+        return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 0xFFFFFFFF, b"WAVE", b"fmt ", 16, 3 if size == 32 else 1, channels,
+                           frequency, frequency * frame_bytes, frame_bytes, abs(size), b"data", 0xFFFFFFFF)
+
+    def put(self, block):
+        # Engine thread: queue a block for encoding, never waiting; the block is dropped if the encoder is behind
+        try:
+            self.blocks.put_nowait(block)
+        except queue.Full:
+            self.dropped += 1
+
+    def encode(self):
+        # Encoder thread: pass the blocks (already at the track's gain) to ffmpeg, or straight to the ring as WAV data
+        while not self.stopped:
+            try:
+                block = self.blocks.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if self.process is None:
+                self.ring.publish(block)
+                continue
+            try:
+                self.process.stdin.write(block)
+                self.process.stdin.flush()
+            except (OSError, ValueError):
+                break
+
+    def read_encoded(self):
+        # Reader thread: publish the MP3 stream to the ring as ffmpeg produces it
+        while True:
+            chunk = self.process.stdout.read1(BROADCAST_CHUNK)
+            if not chunk:
+                break
+            self.ring.publish(chunk)
+
+    def stop(self):
+        # Stop encoding; listeners still connected get no further data
+        self.stopped = True
+        if self.process:
+            self.process.kill()
+            self.process.wait()
+
+
+class EngineServer:
+    # Base class of the servers in front of one or more engines, listening on "host:port" or "unix:" and a socket path
+    name = "Server"
+
+    def __init__(self, engines, address):
+        self.engines = engines
+        self.address = address
+        self.server = None
+
+    async def start(self):
+        # Start listening on the server's address
+        if self.address.startswith("unix:"):
+            self.server = await asyncio.start_unix_server(self.handle, path=self.address[len("unix:"):])
+        else:
+            host, _, port = self.address.rpartition(":")
+            self.server = await asyncio.start_server(self.handle, host or "127.0.0.1", int(port))
+        log.info("%s listening on %s", self.name, self.address)
+
+    async def handle(self, reader, writer):
+        raise NotImplementedError
+
+    async def stop(self):
+        # Stop listening and remove the Unix socket, if any
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.address.startswith("unix:") and os.path.exists(self.address[len("unix:"):]):
+            os.unlink(self.address[len("unix:"):])
+
+    def start_in_thread(self):
+        # Serve from a background thread with its own event loop, for clients that own the main thread
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            except OSError as e:
+                log.warning("%s disabled: %s", self.name, e)
+                return
+            finally:
+                started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+
+
+class ControlServer(EngineServer):
+    # Local control API: one JSON request per line in, one JSON response per line out.
+    # Requests look like {"command": "tune", "station": 2}; "engine" picks an engine when there are several.
+    # Commands: status, metrics, tune (station), next, prev, off, skip, volume (step, or value and optional station).
+    name = "Control API"
+
+    def __init__(self, engines, address=CONTROL_ADDRESS):
+        super().__init__(engines, address)
+
+    async def handle(self, reader, writer):
+        # Answer requests from one connection until it closes
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    engine = self.engines[int(request.get("engine", 0))]
+                    result = await asyncio.wrap_future(engine.call(engine.handle_command, request))
+                    response = {"ok": True, "result": result}
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class BroadcastServer(EngineServer):
+    # Streams stations over HTTP to players on this machine or the LAN, Icecast style. GET /2 is station 2 of the
+    # first engine, GET /1/2 station 2 of the second one, and GET / returns an M3U playlist of every station.
+    # Each station is encoded once, however many listeners it has.
+    name = "Broadcast"
+
+    def __init__(self, engines, address=BROADCAST_ADDRESS):
+        super().__init__(engines, address)
+
+    def resolve(self, path):
+        # (engine, station index) a request path refers to
+        parts = [part for part in path.split("?")[0].split("/") if part]
+        engine = self.engines[int(parts[0]) if len(parts) == 2 else 0]
+        station_index = int(parts[-1]) - 1
+        if len(parts) not in (1, 2) or not 0 <= station_index < engine.num_stations:
+            raise ValueError(path)
+        return engine, station_index
+
+    def playlist(self, host):
+        # M3U playlist with the URL and name of every station
+        lines = ["#EXTM3U"]
+        for engine_index, engine in enumerate(self.engines):
+            for station_index, station in enumerate(engine.stations):
+                path = f"{engine_index}/{station_index + 1}" if len(self.engines) > 1 else f"{station_index + 1}"
+                lines += [f"#EXTINF:-1,{station['name']}", f"http://{host}/{path}"]
+        return ("\r\n".join(lines) + "\r\n").encode()
+
+    async def handle(self, reader, writer):
+        # Serve one HTTP request: the playlist, or a station's stream until the listener disconnects or stalls
+        engine = station_index = None
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request) < 2 or request[0] != "GET":
+                writer.write(b"HTTP/1.0 405 Method Not Allowed\r\nConnection: close\r\n\r\n")
+                return
+            if request[1] in ("/", "/stations.m3u"):
+                body = self.playlist(headers.get("host", self.address))
+                writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: audio/x-mpegurl\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+                return
+            try:
+                target = self.resolve(request[1])
+            except (ValueError, IndexError):
+                writer.write(b"HTTP/1.0 404 Not Found\r\nConnection: close\r\n\r\n")
+                return
+            encoder = await asyncio.wrap_future(target[0].call(target[0].add_listener, target[1]))
+            engine, station_index = target
+            name = engine.stations[station_index]["name"].encode("latin-1", "replace")
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: %s\r\nicy-name: %s\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n"
+                         % (encoder.content_type.encode(), name) + encoder.header())
+            ring = encoder.ring
+            cursor = ring.start()
+            while not encoder.stopped:
+                chunks, cursor = ring.read(cursor)
+                if chunks:
+                    # A listener that cannot keep up falls behind in the ring rather than holding up the encoder
+                    for chunk in chunks:
+                        writer.write(chunk)
+                        await asyncio.wait_for(writer.drain(), BROADCAST_TIMEOUT)
+                else:
+                    try:
+                        await asyncio.wait_for(ring.wait(cursor), BROADCAST_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        pass  # Nothing playing on the station; check whether the listener is still there
+                    if reader.at_eof():
+                        break
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        except asyncio.CancelledError:
+            pass  # The event loop is shutting down with the listener still connected
+        finally:
+            if engine:
+                engine.call(engine.remove_listener, station_index)
+            writer.close()
+
+
+class AudioPlayer:
+    # Tk client of a RadioEngine
+    def __init__(self, root, control_address=None, broadcast_address=None):
+        self.root = root
+        self.root.title("Game Radio Player v0.2 by Cheryl Green")
+        self.root.geometry("800x300")  # Adjusted resolution
+        self.root.configure(bg="black")
+
+        # Initialize attributes before loading settings
+        self.key_bindings = {
+            "prev_station": "Left",
+            "next_station": "Right",
+            "volume_up": "Up",
+            "volume_down": "Down",
+            "off": "o"
+        }
+
+        # The engine loads the settings it owns; the client picks its own out of the same file
+        self.engine = RadioEngine(on_error=self.report_error)
+        settings = self.engine.settings
+        self.key_bindings = settings.get("key_bindings", self.key_bindings)
+        selected_tab = settings.get("selected_tab", 0)
 
         # Ensure 'off' key binding is present
         if 'off' not in self.key_bindings:
@@ -55,20 +3043,50 @@ class AudioPlayer:
         # Set up the GUI elements
         self.create_widgets()
 
-        # Bind keys for switching stations and controlling volume
-        self.bind_keys()
+        # Global hotkeys are carried out on the Tk thread by the playback scheduler; the window's own key
+        # bindings are only made when they cannot be registered
+        self.bound_keys = []  # Event sequences bound in the window
+        self.hotkeys = HotkeyInput({
+            "prev_station": self.engine.prev_station,
+            "next_station": self.engine.next_station,
+            "volume_up": lambda count: self.engine.change_volume(VOLUME_STEP * count),
+            "volume_down": lambda count: self.engine.change_volume(-VOLUME_STEP * count),
+            "off": self.engine.off_station,
+        })
+        self.engine.status_sources["hotkeys"] = self.hotkeys.stats
 
-        # Register global hotkeys
+        # Save settings on close
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+
+        # The window and clock show first; playback starts from the event loop once they are up
+        self.root.after(1, lambda: self.start_playback(selected_tab, control_address or settings.get("control_address"),
+                                                       broadcast_address or settings.get("broadcast_address")))
+
+    def start_playback(self, selected_tab, control_address, broadcast_address):
+        # Second startup stage: global hotkeys, the mixer and the stations, which light up as they become ready
+        self.root.update_idletasks()
         self.register_global_hotkeys()
 
-        # Play all stations simultaneously
-        self.play_all_stations()
+        # Start playback on the Tk event loop
+        self.engine.on_track_change = self.update_current_song_label
+        self.engine.on_station_change = self.show_station
+        self.engine.on_station_ready = self.update_preset_button
+        scheduler = PlaybackScheduler.for_tk(self.root)
+        scheduler.add_task(self.hotkeys.drain)
+        self.engine.start(scheduler)
+        self.tab_control.select(selected_tab)
 
-        # Mute all stations except the first one
-        self.update_station_playback()
+        # Optionally let local automation drive the player too
+        if control_address:
+            ControlServer([self.engine], control_address).start_in_thread()
 
-        # Save settings on close
-        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+        # Optionally stream the stations to other machines
+        if broadcast_address:
+            BroadcastServer([self.engine], broadcast_address).start_in_thread()
+
+    def report_error(self, message):
+        # Show an engine error in a dialog
+        messagebox.showerror("Error", message)
 
     def create_widgets(self):
         # Create main frame with rounded corners
@@ -87,10 +3105,10 @@ class AudioPlayer:
         # Create station preset buttons
         self.preset_frame = tk.Frame(self.main_frame, bg="black")
         self.preset_frame.pack(pady=5)
-        
+
         self.preset_buttons = []
-        for i in range(self.num_stations):
-            preset_button = tk.Button(self.preset_frame, text=f"{self.stations[i]['name']}\nEmpty", fg="white", bg="dark grey", width=20, height=3, command=lambda idx=i: self.set_preset_station(idx))
+        for i in range(min(self.engine.num_stations, PRESET_BUTTONS)):
+            preset_button = tk.Button(self.preset_frame, text=f"{self.engine.stations[i]['name']}\nEmpty", fg="white", bg="dark grey", width=20, height=3, command=lambda idx=i: self.set_preset_station(idx))
             preset_button.grid(row=0, column=i, padx=10)
             self.preset_buttons.append(preset_button)
 
@@ -99,21 +3117,18 @@ class AudioPlayer:
         self.tab_control.pack(expand=1, fill="both")
 
         self.station_tabs = []
-        self.current_song_labels = []
+        self.current_song_labels = {}  # Song label by station index, for the station tabs shown so far
 
         # Add "Off" tab
         off_tab = ttk.Frame(self.tab_control, style="TFrame")
         self.tab_control.add(off_tab, text="Off")
         self.station_tabs.append(off_tab)
 
-        for i in range(self.num_stations):
+        # Station tabs stay empty until they are first shown
+        for i in range(self.engine.num_stations):
             tab = ttk.Frame(self.tab_control, style="TFrame")
-            self.tab_control.add(tab, text=self.stations[i]["name"])
+            self.tab_control.add(tab, text=self.engine.stations[i]["name"])
             self.station_tabs.append(tab)
-            label_frame = tk.Frame(tab, bg="black")
-            label_frame.pack(pady=10)
-            self.current_song_labels.append(tk.Label(label_frame, text="Current Song: ", fg="white", bg="black", font=("Courier New", 14)))
-            self.current_song_labels[-1].pack()
 
         # Add a settings tab
         self.settings_tab = ttk.Frame(self.tab_control, style="TFrame")
@@ -131,6 +3146,16 @@ class AudioPlayer:
         style.configure("TNotebook.Tab", background="grey", foreground="white", padding=10, borderwidth=1)
         style.map("TNotebook.Tab", background=[("selected", "dark grey")], foreground=[("selected", "white")])
 
+    def build_station_tab(self, station_index):
+        # Create the widgets of a station's tab the first time it is shown
+        if station_index in self.current_song_labels:
+            return
+        label_frame = tk.Frame(self.station_tabs[station_index + 1], bg="black")  # +1 to account for "Off" tab
+        label_frame.pack(pady=10)
+        self.current_song_labels[station_index] = tk.Label(label_frame, text="Current Song: ", fg="white", bg="black", font=("Courier New", 14))
+        self.current_song_labels[station_index].pack()
+        self.update_current_song_label(station_index)
+
     def update_clock(self):
         current_time = time.strftime("%H:%M:%S")
         self.clock_label.config(text=current_time)
@@ -138,9 +3163,7 @@ class AudioPlayer:
 
     def set_preset_station(self, idx):
         # Switch to the selected preset station
-        self.current_station = idx + 1  # +1 to account for "Off" tab
-        self.update_station_playback()
-        self.current_station_label.config(text=f"Current Station: {self.stations[idx]['name']}")
+        self.engine.tune(idx + 1)  # +1 to account for "Off" tab
 
     def no_action(self):
         # Placeholder for buttons with no action assigned
@@ -150,44 +3173,18 @@ class AudioPlayer:
         self.settings_frame = tk.Frame(self.settings_tab, bg="black")
         self.settings_frame.pack(pady=10)
 
-        self.path_entries = []  # List to store folder path entries
-        self.browse_buttons = []  # List to store browse buttons
-
-        for i in range(self.num_stations):
-            frame = tk.Frame(self.settings_frame, bg="black")
-            frame.pack(pady=10)
-
-            # Create entry and browse button for songs folder
-            label = tk.Label(frame, text=f"{self.stations[i]['name']} - Songs Folder:", fg="white", bg="black", font=("Helvetica", 10))
-            label.grid(row=0, column=0, padx=5)
-            entry = tk.Entry(frame, width=50)
-            entry.grid(row=0, column=1, padx=5)
-            button = tk.Button(frame, text="Browse", command=lambda idx=i: self.browse_folder(idx, 'songs'), bg="dark grey", fg="white")
-            button.grid(row=0, column=2, padx=5)
-            self.path_entries.append(entry)
-            self.browse_buttons.append(button)
-
-            # Create entry and browse button for voice lines folder
-            label = tk.Label(frame, text=f"{self.stations[i]['name']} - Voice Lines Folder:", fg="white", bg="black", font=("Helvetica", 10))
-            label.grid(row=1, column=0, padx=5)
-            entry = tk.Entry(frame, width=50)
-            entry.grid(row=1, column=1, padx=5)
-            button = tk.Button(frame, text="Browse", command=lambda idx=i: self.browse_folder(idx, 'voice_lines'), bg="dark grey", fg="white")
-            button.grid(row=1, column=2, padx=5)
-            self.path_entries.append(entry)
-            self.browse_buttons.append(button)
-
-        self.rename_station_buttons = []
-        for i in range(self.num_stations):
-            frame = tk.Frame(self.settings_frame, bg="black")
-            frame.pack(pady=10)
-            label = tk.Label(frame, text=f"Rename {self.stations[i]['name']}:", fg="white", bg="black", font=("Helvetica", 10))
-            label.grid(row=0, column=0, padx=5)
-            entry = tk.Entry(frame, width=30)
-            entry.grid(row=0, column=1, padx=5)
-            button = tk.Button(frame, text="Rename", command=lambda idx=i, ent=entry: self.rename_station(idx, ent.get()), bg="dark grey", fg="white")
-            button.grid(row=0, column=2, padx=5)
-            self.rename_station_buttons.append(button)
+        # Folders and names of the stations, in a list with widgets only for the rows in view
+        list_frame = tk.Frame(self.settings_frame, bg="black")
+        list_frame.pack(pady=10)
+        self.settings_rows = []
+        self.settings_first = 0  # Station shown in the first row
+        for _ in range(min(self.engine.num_stations, SETTINGS_ROWS)):
+            self.settings_rows.append(self.create_station_row(list_frame))
+        if self.engine.num_stations > SETTINGS_ROWS:
+            self.settings_scrollbar = tk.Scrollbar(list_frame, orient="vertical", command=self.scroll_station_rows)
+            self.settings_scrollbar.pack(side="right", fill="y")
+        else:
+            self.settings_scrollbar = None
 
         # Key bindings for switching stations and controlling volume
         self.create_key_binding_widgets()
@@ -202,6 +3199,67 @@ class AudioPlayer:
 
         self.update_entries()
 
+    def create_station_row(self, parent):
+        # Widgets for one station's folders and name; show_station_rows decides which station they show
+        row = {"station": 0}
+        frame = tk.Frame(parent, bg="black")
+        frame.pack(pady=10)
+
+        # Create entry and browse button for songs folder
+        row["songs_label"] = tk.Label(frame, fg="white", bg="black", font=("Helvetica", 10))
+        row["songs_label"].grid(row=0, column=0, padx=5)
+        row["songs_entry"] = tk.Entry(frame, width=50)
+        row["songs_entry"].grid(row=0, column=1, padx=5)
+        tk.Button(frame, text="Browse", command=lambda: self.browse_folder(row["station"], 'songs'), bg="dark grey", fg="white").grid(row=0, column=2, padx=5)
+
+        # Create entry and browse button for voice lines folder
+        row["voice_lines_label"] = tk.Label(frame, fg="white", bg="black", font=("Helvetica", 10))
+        row["voice_lines_label"].grid(row=1, column=0, padx=5)
+        row["voice_lines_entry"] = tk.Entry(frame, width=50)
+        row["voice_lines_entry"].grid(row=1, column=1, padx=5)
+        tk.Button(frame, text="Browse", command=lambda: self.browse_folder(row["station"], 'voice_lines'), bg="dark grey", fg="white").grid(row=1, column=2, padx=5)
+
+        # Create entry and button to rename the station
+        row["rename_label"] = tk.Label(frame, fg="white", bg="black", font=("Helvetica", 10))
+        row["rename_label"].grid(row=2, column=0, padx=5)
+        row["rename_entry"] = tk.Entry(frame, width=30)
+        row["rename_entry"].grid(row=2, column=1, padx=5, sticky="w")
+        tk.Button(frame, text="Rename", command=lambda: self.rename_station(row["station"], row["rename_entry"].get()), bg="dark grey", fg="white").grid(row=2, column=2, padx=5)
+
+        # Scroll the list with the mouse wheel
+        for widget in [frame, *frame.winfo_children()]:
+            widget.bind("<MouseWheel>", lambda event: self.scroll_station_rows("scroll", -1 if event.delta > 0 else 1, "units"))
+            widget.bind("<Button-4>", lambda event: self.scroll_station_rows("scroll", -1, "units"))
+            widget.bind("<Button-5>", lambda event: self.scroll_station_rows("scroll", 1, "units"))
+        return row
+
+    def show_station_rows(self, first):
+        # Show the stations from first onwards in the settings rows
+        first = max(0, min(first, self.engine.num_stations - len(self.settings_rows)))
+        self.settings_first = first
+        for offset, row in enumerate(self.settings_rows):
+            row["station"] = first + offset
+            station = self.engine.stations[first + offset]
+            row["songs_label"].config(text=f"{station['name']} - Songs Folder:")
+            row["voice_lines_label"].config(text=f"{station['name']} - Voice Lines Folder:")
+            row["rename_label"].config(text=f"Rename {station['name']}:")
+            for key, folder in (("songs_entry", station['songs_folder']), ("voice_lines_entry", station['voice_lines_folder'])):
+                row[key].delete(0, tk.END)
+                row[key].insert(0, folder)
+        if self.settings_scrollbar:
+            self.settings_scrollbar.set(first / self.engine.num_stations, (first + len(self.settings_rows)) / self.engine.num_stations)
+
+    def scroll_station_rows(self, action, amount, unit=None):
+        # Scrollbar and mouse wheel handler for the settings rows
+        if action == "moveto":
+            first = round(float(amount) * self.engine.num_stations)
+        else:
+            first = self.settings_first + int(amount) * (len(self.settings_rows) if unit == "pages" else 1)
+        if first != self.settings_first:
+            for row in self.settings_rows:
+                row["rename_entry"].delete(0, tk.END)
+        self.show_station_rows(first)
+
     def create_key_binding_widgets(self):
         key_bindings_frame = tk.Frame(self.settings_frame, bg="black")
         key_bindings_frame.pack(pady=10)
@@ -239,207 +3297,107 @@ class AudioPlayer:
         # Button to save key bindings
         tk.Button(key_bindings_frame, text="Save Key Bindings", command=self.save_key_bindings, bg="dark grey", fg="white").grid(row=5, columnspan=2, pady=10)
 
+
     def browse_folder(self, station_index, folder_type):
         # Open a file dialog to select a folder and update the corresponding entry
         folder = filedialog.askdirectory()
         if folder:
-            if folder_type == 'songs':
-                self.stations[station_index]['songs_folder'] = folder
-            elif folder_type == 'voice_lines':
-                self.stations[station_index]['voice_lines_folder'] = folder
+            self.engine.set_station_folder(station_index, folder_type, folder)
             self.update_entries()
-    
+
     def update_entries(self):
         # Update the folder path entries with the selected paths
-        for i in range(self.num_stations):
-            self.path_entries[i*2].delete(0, tk.END)
-            self.path_entries[i*2].insert(0, self.stations[i]['songs_folder'])
-            self.path_entries[i*2+1].delete(0, tk.END)
-            self.path_entries[i*2+1].insert(0, self.stations[i]['voice_lines_folder'])
-            self.preset_buttons[i].config(text=self.stations[i]['name'])
+        self.show_station_rows(self.settings_first)
+        for i in range(len(self.preset_buttons)):
+            self.update_preset_button(i)
+
+    def update_preset_button(self, station_index):
+        # Show a station's name on its preset button, noting if it cannot play yet
+        if station_index < len(self.preset_buttons):
+            name = self.engine.stations[station_index]['name']
+            self.preset_buttons[station_index].config(text=name if self.engine.ready[station_index] else f"{name}\nTuning in...")
 
     def rename_station(self, station_index, new_name):
         # Rename the station tab and update the station name
-        self.stations[station_index]['name'] = new_name
-        self.preset_buttons[station_index].config(text=new_name)
+        self.engine.rename_station(station_index, new_name)
         self.tab_control.tab(station_index + 1, text=new_name)  # +1 to account for "Off" tab
-
-    def calculate_voice_line_probability(self, song_index):
-        # Calculate the probability of inserting a voice line based on the song index
-        return min(0.1 * (song_index + 1), 1.0)
-
-    def shuffle_and_create_playlist(self, station_index):
-        # Create and shuffle the playlist for the specified station
-        station = self.stations[station_index]
-        songs_files = self.get_mp3_files(station['songs_folder'])
-        voice_lines_files = self.get_mp3_files(station['voice_lines_folder'])
-
-        random.shuffle(songs_files)
-        random.shuffle(voice_lines_files)
-
-        playlist = []
-        voice_lines_used = 0
-
-        for i, song in enumerate(songs_files):
-            playlist.append(song)
-            if voice_lines_files and random.random() < self.calculate_voice_line_probability(i - voice_lines_used):
-                playlist.append(voice_lines_files.pop(0))
-                voice_lines_used += 1
-
-        if voice_lines_files:
-            playlist.extend(voice_lines_files)
-
-        self.playlists[station_index] = playlist
-        self.current_indices[station_index] = 0
-
-    def get_mp3_files(self, folder):
-        # Return a list of MP3 files in the specified folder
-        try:
-            if not folder or not os.path.isdir(folder):
-                return []
-            return [os.path.join(folder, file) for file in os.listdir(folder) if file.endswith(".mp3")]
-        except Exception as e:
-            messagebox.showerror("Error", f"Error reading folder '{folder}': {e}")
-            return []
-
-    def play_audio(self, station_index):
-        # Play the audio for the given station
-        try:
-            if self.current_indices[station_index] < len(self.playlists[station_index]):
-                current_track = self.playlists[station_index][self.current_indices[station_index]]
-                sound = mixer.Sound(current_track)
-                self.channels[station_index].play(sound)
-                self.is_playing[station_index] = True
-                self.update_current_song_label(station_index)
-                self.root.after(100, self.check_music_end)
-                print(f"Playing: {current_track} from {self.positions[station_index]} seconds")
-        except Exception as e:
-            messagebox.showerror("Error", f"Error playing audio: {e}")
+        self.update_entries()
 
     def update_current_song_label(self, station_index):
-        # Update the label to display the current song
-        current_station = self.stations[station_index]
-        current_track = self.playlists[station_index][self.current_indices[station_index]]
-        
-        if current_station['voice_lines_folder'] in current_track:
-            self.current_song_labels[station_index].config(text="Current Song: [Intermission]")
-        else:
-            self.current_song_labels[station_index].config(text=f"Current Song: {os.path.basename(current_track)}")
-        print(f"Current: {self.current_song_labels[station_index].cget('text')}")
-
-    def check_music_end(self):
-        # Check if the music has ended and move to the next track if necessary
-        try:
-            for station_index in range(self.num_stations):
-                if not self.channels[station_index].get_busy() and self.is_playing[station_index]:
-                    self.next_track(station_index)
-            # Schedule the next check
-            self.root.after(100, self.check_music_end)
-        except Exception as e:
-            messagebox.showerror("Error", f"Error checking music end: {e}")
-
-    def next_track(self, station_index):
-        # Move to the next track in the playlist for the given station
-        try:
-            self.current_indices[station_index] += 1
-            if self.current_indices[station_index] >= len(self.playlists[station_index]):
-                self.shuffle_and_create_playlist(station_index)
-            self.play_audio(station_index)
-        except Exception as e:
-            messagebox.showerror("Error", f"Error switching to next track: {e}")
+        # Update the label to display the current song, if the station's tab has been shown
+        if station_index not in self.current_song_labels:
+            return
+        text = self.engine.describe_track(station_index)
+        if text is None:
+            return
+        self.current_song_labels[station_index].config(text=text)
+        log.debug("Station %d: %s", station_index, text)
+
+    def show_station(self):
+        # Reflect the engine's current station in the tabs and the station label
+        station = self.engine.current_station
+        if self.tab_control.index(self.tab_control.select()) != station:
+            self.tab_control.select(station)  # Update the GUI tab
+        if station == 0:
+            self.current_station_label.config(text="Current Station: Off")
+        elif station <= self.engine.num_stations:
+            self.current_station_label.config(text=f"Current Station: {self.engine.stations[station-1]['name']}")
 
     def prev_station(self, event=None):
         # Switch to the previous station, skipping the "Off" tab
-        self.current_station = (self.current_station - 1) % (self.num_stations + 1)  # Include "Off" tab
-        if self.current_station == 0:  # Skip "Off" tab
-            self.current_station = self.num_stations
-        self.tab_control.select(self.current_station)  # Update the GUI tab
-        self.update_station_playback()
-        if self.current_station == 0:
-            self.current_station_label.config(text="Current Station: Off")
-        else:
-            self.current_station_label.config(text=f"Current Station: {self.stations[self.current_station-1]['name']}")
+        self.engine.prev_station()
 
     def next_station(self, event=None):
         # Switch to the next station, skipping the "Off" tab
-        self.current_station = (self.current_station + 1) % (self.num_stations + 1)  # Include "Off" tab
-        if self.current_station == 0:  # Skip "Off" tab
-            self.current_station = 1
-        self.tab_control.select(self.current_station)  # Update the GUI tab
-        self.update_station_playback()
-        self.current_station_label.config(text=f"Current Station: {self.stations[self.current_station-1]['name']}")
+        self.engine.next_station()
 
     def off_station(self, event=None):
         # Switch to the "Off" station
-        self.current_station = 0
-        self.tab_control.select(self.current_station)  # Update the GUI tab
-        self.update_station_playback()
-        self.current_station_label.config(text="Current Station: Off")
+        self.engine.off_station()
 
     def on_tab_change(self, event):
         # Handle tab change events to switch stations
-        self.current_station = self.tab_control.index(self.tab_control.select())
-        self.update_station_playback()
-
-    def update_station_playback(self):
-        # Adjust the volume for the current station and mute others
-        if self.current_station == 0:
-            # Mute all channels for the "Off" tab
-            for i in range(self.num_stations):
-                self.channels[i].set_volume(0)
-        else:
-            for i in range(self.num_stations):
-                if i == self.current_station - 1:
-                    self.channels[i].set_volume(self.volumes[i])
-                    self.update_current_song_label(i)
-                else:
-                    self.channels[i].set_volume(0)
+        station = self.tab_control.index(self.tab_control.select())
+        if 0 < station <= self.engine.num_stations:
+            self.build_station_tab(station - 1)
+        if station != self.engine.current_station:
+            self.engine.tune(station)
 
     def bind_keys(self):
-        # Bind keys for switching stations and controlling volume
-        self.root.bind(f"<{self.key_bindings['prev_station']}>", self.prev_station)
-        self.root.bind(f"<{self.key_bindings['next_station']}>", self.next_station)
-        self.root.bind(f"<{self.key_bindings['volume_up']}>", self.increase_volume)
-        self.root.bind(f"<{self.key_bindings['volume_down']}>", self.decrease_volume)
-        self.root.bind(f"<{self.key_bindings['off']}>", self.off_station)
+        # Bind keys for switching stations and controlling volume in the window, replacing the previous ones, unless
+        # the global hotkeys are listening: they see the same key presses, which would then act twice
+        for sequence in self.bound_keys:
+            self.root.unbind(sequence)
+        self.bound_keys = []
+        if self.hotkeys.listener is not None:
+            return
+        for action, callback in (("prev_station", self.prev_station), ("next_station", self.next_station),
+                                 ("volume_up", self.increase_volume), ("volume_down", self.decrease_volume),
+                                 ("off", self.off_station)):
+            sequence = f"<{self.key_bindings[action]}>"
+            self.root.bind(sequence, callback)
+            self.bound_keys.append(sequence)
 
     def register_global_hotkeys(self):
-        # Register global hotkeys for switching stations and controlling volume
-        def on_press(key):
-            try:
-                if key == keyboard.Key[self.key_bindings["prev_station"].lower()]:
-                    self.prev_station()
-                elif key == keyboard.Key[self.key_bindings["next_station"].lower()]:
-                    self.next_station()
-                elif key == keyboard.Key[self.key_bindings["volume_up"].lower()]:
-                    self.increase_volume()
-                elif key == keyboard.Key[self.key_bindings["volume_down"].lower()]:
-                    self.decrease_volume()
-                elif key.char == self.key_bindings["off"]:
-                    self.off_station()
-            except AttributeError:
-                pass
-
-        listener = keyboard.Listener(on_press=on_press)
-        listener.start()
+        # Register global hotkeys for switching stations and controlling volume, replacing the previous ones; the
+        # keys are bound in the window instead if the global listener cannot run
+        try:
+            self.hotkeys.set_bindings(self.key_bindings)
+        except Exception as e:
+            log.warning("Global hotkeys unavailable, keys only work in the window: %s", e)
+        self.bind_keys()
 
     def increase_volume(self, event=None):
         # Increase the volume
-        if self.current_station > 0:
-            self.volumes[self.current_station - 1] = min(self.volumes[self.current_station - 1] + 0.1, 1.0)
-        self.update_station_playback()
+        self.engine.change_volume(VOLUME_STEP)
 
     def decrease_volume(self, event=None):
         # Decrease the volume
-        if self.current_station > 0:
-            self.volumes[self.current_station - 1] = max(self.volumes[self.current_station - 1] - 0.1, 0.0)
-        self.update_station_playback()
+        self.engine.change_volume(-VOLUME_STEP)
 
     def set_volume(self, val, station_index=None):
         # Set the volume for the audio playback
-        if station_index is not None:
-            self.volumes[station_index] = float(val)
-        self.update_station_playback()
+        self.engine.set_volume(val, station_index)
 
     def save_key_bindings(self):
         # Save the key bindings
@@ -448,72 +3406,102 @@ class AudioPlayer:
         self.key_bindings["volume_up"] = self.volume_up_entry.get()
         self.key_bindings["volume_down"] = self.volume_down_entry.get()
         self.key_bindings["off"] = self.off_entry.get()
-        self.bind_keys()
         self.register_global_hotkeys()
         self.save_settings()
 
-    def load_settings(self):
-        # Load settings from a JSON file
-        print("Loading settings...")
-        if os.path.exists(SETTINGS_FILE):
-            try:
-                with open(SETTINGS_FILE, 'r') as f:
-                    settings = json.load(f)
-                    self.num_stations = settings.get("num_stations", self.num_stations)
-                    self.stations = settings.get("stations", self.stations)  # Only overwrite if settings provide stations
-                    self.volumes = settings.get("volumes", [0.5] * self.num_stations)
-                    self.key_bindings = settings.get("key_bindings", self.key_bindings)
-                    self.current_station = settings.get("current_station", 0)
-                    selected_tab = settings.get("selected_tab", 0)
-                    self.root.after(100, lambda: self.tab_control.select(selected_tab))
-                print(f"Settings loaded: {settings}")
-            except json.JSONDecodeError as e:
-                messagebox.showerror("Error", f"Error loading settings: Invalid JSON format. {e}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Error loading settings: {e}")
-        else:
-            print("Settings file not found. Using default settings.")
-        
-        if 'off' not in self.key_bindings:
-            self.key_bindings['off'] = 'o'
-
     def save_settings(self):
-        # Save settings to a JSON file
-        settings = {
-            "num_stations": self.num_stations,
-            "stations": self.stations,
-            "volumes": self.volumes,
+        # Save the engine's settings along with the key bindings and selected tab
+        self.engine.save_settings({
             "key_bindings": self.key_bindings,
-            "current_station": self.current_station,
             "selected_tab": self.tab_control.index(self.tab_control.select())
-        }
-        try:
-            with open(SETTINGS_FILE, 'w') as f:
-                json.dump(settings, f)
-            print(f"Settings saved: {settings}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Error saving settings: {e}")
+        })
 
     def on_closing(self):
         # Save settings before closing the application
         self.save_settings()
+        self.hotkeys.stop()
+        self.engine.stop_playback()
         self.root.destroy()
 
     def restart_app(self):
         self.save_settings()
+        self.hotkeys.stop()
+        self.engine.stop_playback()
         self.root.destroy()
         os.execl(sys.executable, sys.executable, *sys.argv)
 
-    def play_all_stations(self):
-        for station_index in range(self.num_stations):
-            if self.stations[station_index]['songs_folder'] and os.path.isdir(self.stations[station_index]['songs_folder']):
-                self.shuffle_and_create_playlist(station_index)
-                self.play_audio(station_index)
+
+class JsonLogFormatter(logging.Formatter):
+    # One JSON object per log record, for log collectors
+    def format(self, record):
+        entry = {"time": round(record.created, 3), "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def setup_logging(level="INFO", json_lines=False):
+    # Log to stderr, as text or as JSON lines
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonLogFormatter() if json_lines else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logging.basicConfig(level=level.upper(), handlers=[handler])
+
+
+def run_headless(settings_files, control_address=None, broadcast_address=None):
+    # Run one engine per settings file on an asyncio event loop, without a window, until interrupted
+    async def main():
+        loop = asyncio.get_running_loop()
+        engines = []
+        shared = SharedResources()  # Every engine plays through the one mixer and keeps its library in the one folder
+        for settings_file in settings_files:
+            engine = RadioEngine(settings_file)
+            engine.start(PlaybackScheduler.for_asyncio(loop), shared)
+            engine.tune(engine.settings.get("current_station", 0))
+            engines.append(engine)
+
+        servers = []
+        if control_address:
+            servers.append(ControlServer(engines, control_address))
+        if broadcast_address:
+            servers.append(BroadcastServer(engines, broadcast_address))
+        for server in servers:
+            await server.start()
+
+        stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Not available on Windows; Ctrl+C still ends asyncio.run
+        try:
+            await stopping.wait()
+        finally:
+            for server in servers:
+                await server.stop()
+            for engine in engines:
+                engine.save_settings()
+                engine.stop_playback()
+            shared.close()
+
+    asyncio.run(main())
+
 
 if __name__ == "__main__":
-    print("Launching application")
-    root = tk.Tk()
-    app = AudioPlayer(root)
-    print("Running mainloop")
-    root.mainloop()
-    print("Application closed")
+    parser = argparse.ArgumentParser(description="Custom radio player")
+    parser.add_argument("--headless", action="store_true", help="play without a window")
+    parser.add_argument("--settings", action="append", help="settings file; repeat to run several engines headless")
+    parser.add_argument("--control", help=f"serve the control API on host:port or unix:path (e.g. {CONTROL_ADDRESS})")
+    parser.add_argument("--broadcast", help=f"stream the stations over HTTP on host:port (e.g. {BROADCAST_ADDRESS})")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG also logs every track change")
+    parser.add_argument("--log-json", action="store_true", help="log one JSON object per line")
+    args = parser.parse_args()
+    setup_logging(args.log_level, args.log_json)
+    if args.headless:
+        log.info("Running headless")
+        run_headless(args.settings or [SETTINGS_FILE], args.control, args.broadcast)
+    else:
+        log.info("Launching application")
+        root = tk.Tk()
+        app = AudioPlayer(root, args.control, args.broadcast)
+        root.mainloop()
+    log.info("Application closed")
@@ -0,0 +1,107 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+import benchmark
+from benchmark import install_fakes, simulated_stations
+
+SECONDS = 5.0  # How long each listener stays connected
+DATA_RATE = 352800  # Bytes per second a station broadcasts as WAV at the fake mixer's frequency below
+
+
+class RealClock:
+    # The fake mixer's channels play in real time, as the listeners' sockets do
+    now = property(lambda self: time.monotonic())
+
+
+@pytest.fixture
+def radio(tmp_path, monkeypatch):
+    # radio_beta on the fake mixer in real time, with a small ring and small socket buffers so listeners fall behind quickly
+    radio = install_fakes(RealClock())
+    monkeypatch.setattr(radio, "time", time)
+    monkeypatch.setattr(benchmark, "FAKE_FREQUENCY", DATA_RATE // 2)
+    monkeypatch.setattr(radio.BroadcastRing.__init__, "__defaults__", (2,))
+    monkeypatch.setattr(radio, "BROADCAST_BURST", 1)
+    monkeypatch.setattr(radio, "BROADCAST_TIMEOUT", 3.0)
+    handle = radio.BroadcastServer.handle
+
+    async def small_buffers(server, reader, writer):
+        writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        writer.transport.set_write_buffer_limits(16384)
+        await handle(server, reader, writer)
+
+    monkeypatch.setattr(radio.BroadcastServer, "handle", small_buffers)
+    monkeypatch.chdir(tmp_path)
+    return radio
+
+
+def listen(radio, folder, rate):
+    # Broadcast station 1 to a listener reading rate bytes per second (as fast as it can if None, not at all if 0)
+    # for SECONDS; returns the bytes it got, whether the server closed the connection, the station's listeners
+    # and the chunks its ring skipped by then
+    async def main():
+        engine = radio.RadioEngine(simulated_stations(folder, 1, 10))
+        engine.start(radio.PlaybackScheduler.for_asyncio(asyncio.get_running_loop()))
+        engine.tune(1)
+        server = radio.BroadcastServer([engine], "127.0.0.1:0")
+        await server.start()
+        try:
+            while not engine.ready[0]:
+                await asyncio.sleep(0.05)
+            sock = socket.socket()
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            sock.connect(server.server.sockets[0].getsockname())
+            reader, writer = await asyncio.open_connection(sock=sock)
+            writer.write(b"GET /1 HTTP/1.0\r\n\r\n")
+            while engine.encoders[0] is None:
+                await asyncio.sleep(0.01)
+            ring = engine.encoders[0].ring
+            received = 0
+            closed = False
+            end = time.monotonic() + SECONDS
+            while time.monotonic() < end and not closed:
+                if rate is None:
+                    try:
+                        data = await asyncio.wait_for(reader.read(65536), end - time.monotonic())
+                    except asyncio.TimeoutError:
+                        break
+                elif rate:
+                    data = await reader.read(rate // 10)
+                    await asyncio.sleep(0.1)
+                else:
+                    await asyncio.sleep(end - time.monotonic())
+                    break
+                closed = not data
+                received += len(data)
+            await asyncio.sleep(0.2)  # Let the engine hear about a dropped listener
+            listeners = engine.listeners[0]
+            writer.close()
+            return received, closed, listeners, ring.skipped
+        finally:
+            await server.stop()
+            engine.stop_playback()
+
+    return asyncio.run(main())
+
+
+def test_listener_in_real_time_gets_everything(radio, tmp_path):
+    received, closed, listeners, skipped = listen(radio, str(tmp_path), None)
+    assert not closed
+    assert listeners == 1
+    assert skipped == 0
+    assert received >= DATA_RATE * SECONDS / 2
+
+
+def test_slow_listener_skips_ahead(radio, tmp_path):
+    received, closed, listeners, skipped = listen(radio, str(tmp_path), DATA_RATE // 4)
+    assert not closed
+    assert listeners == 1
+    assert skipped > 0
+    assert received > 0
+
+
+def test_stalled_listener_is_dropped(radio, tmp_path):
+    received, closed, listeners, skipped = listen(radio, str(tmp_path), 0)
+    assert listeners == 0  # Dropped after BROADCAST_TIMEOUT; the listener only finds out once it reads again
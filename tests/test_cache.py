@@ -0,0 +1,21 @@
+import errno
+import os
+
+from benchmark import VirtualClock, install_fakes, synthetic_folder
+
+
+def test_failing_cache_disk_does_not_stop_the_track(tmp_path, monkeypatch):
+    radio = install_fakes(VirtualClock())
+    radio.mixer.init()
+    track = os.path.join(synthetic_folder(str(tmp_path / "Songs"), 1), "disc 0", "Artist 0 - Song 0.mp3")
+    cache = radio.AudioCache(str(tmp_path / "cache"))
+    block_bytes = radio.get_block_bytes()
+    expected = list(radio.decode_pcm_blocks(track, block_bytes))
+
+    def full_disk(writer, block):
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    monkeypatch.setattr(radio.CacheWriter, "write", full_disk)
+    assert list(radio.iter_pcm_blocks(track, block_bytes, cache=cache)) == expected
+    assert os.listdir(cache.folder) == []
+    assert cache.total == 0
@@ -0,0 +1,79 @@
+import threading
+import time
+
+from benchmark import Simulation, synthetic_folder
+
+
+def test_durations_are_probed_off_the_engine_thread(tmp_path, monkeypatch):
+    sim = Simulation(str(tmp_path), stations=3, songs=20)
+    probes = []
+    probe_track = sim.radio.probe_track
+
+    def recorded_probe(path):
+        probes.append(threading.get_ident())
+        return probe_track(path)
+
+    monkeypatch.setattr(sim.radio, "probe_track", recorded_probe)
+    try:
+        sim.start()
+        deadline = time.monotonic() + 10
+        while any(sim.engine.library.pending_details(folder, 1) for folder in sim.engine.get_station_folders()):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        # Hop between stations for a few simulated hours, so each one catches up on the tracks it missed
+        for hour in range(3):
+            for station in (1, 2, 3):
+                sim.engine.tune(station)
+                sim.run(1200)
+        assert probes
+        assert sim.engine.thread not in probes
+        assert sim.engine.get_track_duration(sim.engine.playlists[0][0])
+    finally:
+        sim.stop()
+
+
+def test_unknown_duration_plays_from_the_start(tmp_path):
+    sim = Simulation(str(tmp_path), stations=2, songs=20)
+    try:
+        sim.start()
+        sim.engine.duration_prober.stop()
+        sim.engine.duration_prober.thread.join()
+        sim.engine.tune(2)
+        sim.run(5)
+        sim.engine.library.db.execute("UPDATE files SET duration = NULL, probed = 0")
+        sim.engine.tune(1)
+        sim.run(600)
+        sim.engine.tune(2)
+        sim.run(1)
+        # Station 2 was not heard for ten minutes, but without durations it cannot tell how many tracks it missed
+        assert sim.clock.now - sim.engine.track_started[1] <= 1
+    finally:
+        sim.stop()
+
+
+def test_new_folder_is_scanned_off_the_engine_thread(tmp_path, monkeypatch):
+    sim = Simulation(str(tmp_path), stations=1, songs=20)
+    scans = []  # (thread, files added) of every library scan
+    scan = sim.radio.MediaLibrary.scan
+
+    def recorded_scan(library, folder, *args, **kwargs):
+        added, removed = scan(library, folder, *args, **kwargs)
+        scans.append((threading.get_ident(), len(added)))
+        return added, removed
+
+    monkeypatch.setattr(sim.radio.MediaLibrary, "scan", recorded_scan)
+    try:
+        sim.start()
+        sim.engine.tune(1)
+        sim.run(1)
+        folder = synthetic_folder(str(tmp_path / "New Songs"), 30)
+        sim.engine.set_station_folder(0, "songs", folder)
+        deadline = time.monotonic() + 10
+        while not sim.engine.playlists[0][0].startswith(folder):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+            sim.run(0.1)
+        assert sim.engine.is_playing[0]
+        assert not [added for thread, added in scans if thread == sim.engine.thread and added]
+    finally:
+        sim.stop()
@@ -0,0 +1,28 @@
+from benchmark import Simulation, VirtualClock, install_fakes
+
+
+def test_track_gain_is_applied_to_the_pcm(tmp_path):
+    radio = install_fakes(VirtualClock())
+    radio.mixer.init()
+    radio.import_numpy()
+    block = radio.array_to_pcm(radio.pcm_to_array(bytes(400)) + 1000)
+    stream = radio.TrackStream(str(tmp_path / "Song.mp3"), radio.PrefetchedHead([block], complete=True), gain=2.5)
+    assert set(radio.pcm_to_array(stream.next_block()).ravel()) == {2500}
+
+
+def test_channel_volume_is_the_station_volume(tmp_path):
+    sim = Simulation(str(tmp_path), stations=1, songs=10)
+    try:
+        sim.start()
+        sim.engine.normalize_loudness = True
+        for folder in sim.engine.get_station_folders():
+            for path in sim.engine.library.tracks(folder):
+                sim.engine.library.set_loudness(path, sim.radio.LOUDNESS_TARGET + 6)
+        sim.engine.set_volume(0.8, 0)
+        sim.engine.tune(1)
+        while sim.tracks < 4:
+            sim.run(1)
+            assert sim.engine.track_gains[0] < 1
+            assert sim.engine.channels[0].get_volume() == 0.8
+    finally:
+        sim.stop()
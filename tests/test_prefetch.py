@@ -0,0 +1,46 @@
+from benchmark import Simulation, simulated_stations
+
+TRACKS = 8  # Track changes to play through
+
+
+def test_prefetched_tracks_play_back_to_back(tmp_path):
+    sim = Simulation(str(tmp_path), stations=1, songs=10)
+    try:
+        sim.start()
+        sim.engine.tune(1)
+        sim.run(1)
+        hits = sim.engine.prefetcher.hits
+        while sim.tracks < TRACKS:
+            sim.run(1)
+        # Songs start from their prefetched heads (voice lines come from the voice line bank instead)
+        assert sim.engine.prefetcher.hits - hits >= TRACKS // 2
+        gaps = sim.engine.metrics.snapshot()["stations"].get("0", {}).get("gap")
+        assert gaps is None or gaps["max_ms"] == 0
+    finally:
+        sim.stop()
+
+
+def test_engines_share_one_library_cache_and_prefetcher(tmp_path):
+    sim = Simulation(str(tmp_path), stations=1, songs=10)
+    try:
+        sim.start()
+        other = sim.radio.RadioEngine(simulated_stations(str(tmp_path / "Other"), 1, 10))
+        other.start(sim.radio.PlaybackScheduler(sim.loop.schedule, sim.loop.cancel), sim.engine.shared)
+        assert other.library is sim.engine.library
+        assert other.audio_cache is sim.engine.audio_cache
+        assert other.prefetcher is sim.engine.prefetcher
+        sim.engine.tune(1)
+        other.tune(1)
+        while not all(other.scanned):
+            sim.run(1)
+        sim.run(5)
+        assert set(sim.engine.prefetcher.pending) <= {(sim.engine, 0), (other, 0)}
+        other.stop_playback()
+        # The engine that stopped leaves the shared resources to the one still playing
+        assert sim.engine.shared.engines == [sim.engine]
+        assert sim.engine.library.tracks(sim.engine.get_station_folders()[0])
+        tracks = sim.tracks
+        while sim.tracks < tracks + 2:
+            sim.run(1)
+    finally:
+        sim.stop()
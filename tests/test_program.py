@@ -0,0 +1,49 @@
+import time
+
+from radio_beta import ProgramSchedule
+
+MONDAY = (2026, 10, 19)  # A Monday
+
+
+def at(day, hour, minute=1):
+    # time.time() value of a local time in the week of MONDAY, day 0 being Monday
+    return time.mktime((MONDAY[0], MONDAY[1], MONDAY[2] + day, hour, minute, 0, 0, 0, -1))
+
+
+def show(schedule, moment):
+    block = schedule.block_at(moment)
+    return block and block["name"]
+
+
+def test_nested_block_hands_back_to_the_outer_one():
+    schedule = ProgramSchedule({"blocks": [
+        {"name": "day", "start": "08:00", "end": "18:00"},
+        {"name": "noon", "start": "12:00", "end": "13:00"},
+    ]})
+    assert show(schedule, at(0, 7)) is None
+    assert show(schedule, at(0, 11)) == "day"
+    assert show(schedule, at(0, 12)) == "noon"
+    assert show(schedule, at(0, 14)) == "day"
+    assert show(schedule, at(0, 17)) == "day"
+    assert show(schedule, at(0, 18)) is None
+
+
+def test_overnight_block_runs_past_midnight_and_the_end_of_the_week():
+    schedule = ProgramSchedule({"blocks": [
+        {"name": "night", "start": "22:00", "end": "02:00", "days": ["sun"]},
+        {"name": "early", "start": "01:00", "end": "03:00", "days": ["mon"]},
+    ]})
+    assert show(schedule, at(6, 21)) is None
+    assert show(schedule, at(6, 23)) == "night"
+    assert show(schedule, at(0, 0)) == "night"  # Monday 00:01, continuing from Sunday night
+    assert show(schedule, at(0, 1)) == "early"
+    assert show(schedule, at(0, 2)) == "early"
+    assert show(schedule, at(0, 3)) is None
+
+
+def test_breaks_between():
+    schedule = ProgramSchedule({"jingles_folder": "jingles", "ads_folder": "ads", "ad_breaks": [15, 45]})
+    assert schedule.breaks_between(at(0, 9, 10), at(0, 9, 14)) == (False, False)
+    assert schedule.breaks_between(at(0, 9, 14), at(0, 9, 16)) == (True, False)
+    assert schedule.breaks_between(at(0, 9, 58), at(0, 10, 2)) == (False, True)
+    assert schedule.breaks_between(at(0, 9, 50), at(0, 10, 20)) == (True, True)
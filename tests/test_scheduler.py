@@ -0,0 +1,36 @@
+from benchmark import Simulation
+
+TRACKS = 40  # Track changes to play through
+
+
+def live_timers(loop):
+    # Timers scheduled on the loop that have not been cancelled
+    return sum(1 for timer in loop.timers if timer[2] is not None)
+
+
+def test_one_timer_and_flat_tick_cost_across_track_changes(tmp_path):
+    sim = Simulation(str(tmp_path), stations=2, songs=10)
+    scheduler = None
+    try:
+        sim.start()
+        sim.engine.tune(1)
+        scheduler = sim.engine.scheduler
+        samples = []  # (scheduler ticks, loop CPU seconds) at each track change
+        while sim.tracks < TRACKS:
+            tracks = sim.tracks
+            sim.run(1)
+            assert scheduler.pending == 1
+            assert live_timers(sim.loop) == 1
+            if sim.tracks != tracks:
+                samples.append((scheduler.ticks, sim.loop.cpu_seconds))
+        # However many tracks have gone by, the scheduler only ever keeps its own few one-shot timers
+        assert len(scheduler.timers) <= 4
+
+        def cost_per_tick(first, last):
+            return (last[1] - first[1]) / (last[0] - first[0])
+
+        early = cost_per_tick(samples[5], samples[15])
+        late = cost_per_tick(samples[-11], samples[-1])
+        assert late < early * 2 + 0.0001
+    finally:
+        sim.stop()
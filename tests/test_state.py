@@ -0,0 +1,53 @@
+import os
+import threading
+import time
+
+from benchmark import Simulation
+
+
+def start_restored(sim, monkeypatch):
+    # Start a second engine on the first one's settings and state, with its folder scans held back
+    scans = threading.Event()
+    scan = sim.radio.MediaLibrary.scan
+
+    def held_scan(library, folder):
+        scans.wait(10)
+        return scan(library, folder)
+
+    monkeypatch.setattr(sim.radio.MediaLibrary, "scan", held_scan)
+    engine = sim.radio.RadioEngine(sim.engine.settings_file)
+    engine.current_station = 1
+    engine.start(sim.radio.PlaybackScheduler(sim.loop.schedule, sim.loop.cancel))
+    sim.run(1)
+    return engine, scans
+
+
+def test_restored_station_plays_before_its_folders_are_scanned_and_finishes_its_cycle(tmp_path, monkeypatch):
+    sim = Simulation(str(tmp_path), stations=2, songs=20)
+    sim.engine.current_station = 1
+    sim.start()
+    sim.run(600)
+    playing = sim.engine.playlists[0][sim.engine.current_indices[0]]
+    sim.engine.stop_playback()
+    history = list(sim.engine.play_histories[0])
+    rest_of_cycle = list(sim.engine.playlist_sources[0])
+
+    engine, scans = start_restored(sim, monkeypatch)
+    try:
+        assert engine.ready == [True, False]  # Only the station that was tuned in had a playlist to restore
+        assert engine.scanned == [False, False]
+        assert engine.is_playing[0]
+        assert engine.playlists[0][engine.current_indices[0]] == playing
+        assert list(engine.play_histories[0]) == history
+        assert list(engine.playlist_sources[0]) == rest_of_cycle
+        scans.set()
+        deadline = time.monotonic() + 10
+        while not all(engine.scanned) and time.monotonic() < deadline:
+            time.sleep(0.01)
+            sim.run(0.1)
+        assert all(engine.scanned)
+        assert engine.is_playing[0]
+    finally:
+        scans.set()
+        engine.stop_playback()
+        os.chdir(sim.previous_folder)
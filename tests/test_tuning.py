@@ -0,0 +1,45 @@
+import pytest
+
+from benchmark import Simulation
+
+
+def test_switch_without_virtual_radio_fades(tmp_path, monkeypatch):
+    sim = Simulation(str(tmp_path), stations=2, songs=10, virtual_radio=False)
+    fadeouts, tune_ins = [], []
+    monkeypatch.setattr(sim.radio.TrackStream, "tune_in", lambda stream, seconds, static=None: tune_ins.append(stream))
+    try:
+        sim.start()
+        sim.engine.tune(1)
+        while not all(sim.engine.ready):
+            sim.run(1)
+        sim.run(5)
+        old_channel = sim.engine.channels[0]
+        monkeypatch.setattr(old_channel, "fadeout", lambda ms: fadeouts.append(ms), raising=False)
+        tune_ins.clear()
+        sim.engine.tune(2)
+        assert fadeouts == [int(sim.radio.TUNING_SECONDS * 1000)]
+        assert tune_ins == [sim.engine.streams[1]]
+        assert sim.engine.channels[0] is not old_channel
+        assert sim.engine.channels[0].get_volume() == 0
+        assert sim.engine.channels[1].get_volume() == sim.engine.volumes[1]
+        sim.run(5)
+        assert sim.engine.is_playing == [True, True]
+    finally:
+        sim.stop()
+
+
+def test_control_commands_stay_in_range(tmp_path):
+    sim = Simulation(str(tmp_path), stations=2, songs=10)
+    try:
+        sim.start()
+        for station in (-1, 4):
+            with pytest.raises(ValueError):
+                sim.engine.handle_command({"command": "tune", "station": station})
+        assert sim.engine.current_station == 0
+        sim.engine.handle_command({"command": "tune", "station": 3})
+        assert sim.engine.current_station == 3
+        sim.engine.handle_command({"command": "volume", "station": 1, "value": 5})
+        sim.engine.handle_command({"command": "volume", "station": 2, "value": -1})
+        assert sim.engine.volumes == [1.0, 0.0]
+    finally:
+        sim.stop()
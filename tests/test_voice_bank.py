@@ -0,0 +1,17 @@
+import os
+
+from benchmark import VirtualClock, install_fakes, synthetic_folder
+
+
+def test_bank_stays_within_its_limit(tmp_path):
+    radio = install_fakes(VirtualClock())
+    radio.mixer.init()
+    folder = synthetic_folder(str(tmp_path / "Voice"), 20, "Voice Line {i}.mp3")
+    limit = radio.get_block_bytes(20)
+    bank = radio.VoiceLineBank(folder, limit)
+    paths = [os.path.join(folder, "disc 0", f"Voice Line {i}.mp3") for i in range(20)]
+    bank.load(paths)
+    assert 0 < bank.nbytes <= limit
+    # The voice lines that did not fit are left to be streamed like songs
+    assert 0 < len(bank.clips) < len(paths)
+    assert all(path in bank for path in bank.clips)